@@ -0,0 +1,691 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+
+# marks a key erased inside bulk_loading()
+ERASED = object()
+
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+
+
+class BaseNode(ABC):
+    # Rotation, rebalancing, split and join shared by AVLTree and AVLTreeMap.
+    # Subclasses decide what an element ("item") is: a bare key for the set,
+    # a (key, value) pair for the map.
+    __slots__ = ("key", "left", "right", "height", "size")
+
+    def __init__(self, key, left=None, right=None, height=1, size=1):
+        self.key = key
+        self.left = left
+        self.right = right
+        self.height = height
+        self.size = size
+
+    @classmethod
+    @abstractmethod
+    def make(cls, key, value):
+        pass
+
+    @classmethod
+    @abstractmethod
+    def from_item(cls, item):
+        pass
+
+    @staticmethod
+    @abstractmethod
+    def item_key(item):
+        pass
+
+    @abstractmethod
+    def item(self):
+        pass
+
+    @abstractmethod
+    def set_value(self, value):
+        pass
+
+    @abstractmethod
+    def copy_item(self, other):
+        pass
+
+    def update_height(self):
+        left = self.left
+        right = self.right
+        left_height = 0 if left is None else left.height
+        right_height = 0 if right is None else right.height
+        self.height = 1 + (left_height if left_height > right_height else right_height)
+        self.size = 1 + (0 if left is None else left.size) + (0 if right is None else right.size)
+
+    def right_rotate(self):
+        child = self.left
+        self.left = child.right
+        child.right = self
+
+        self.update_height()
+        child.update_height()
+        return child
+
+    def left_rotate(self):
+        child = self.right
+        self.right = child.left
+        child.left = self
+
+        self.update_height()
+        child.update_height()
+        return child
+
+    @staticmethod
+    def get_height(root):
+        return 0 if root is None else root.height
+
+    @staticmethod
+    def get_size(root):
+        return 0 if root is None else root.size
+
+    @staticmethod
+    def get_factor(root):
+        if root is None:
+            return 0
+        return BaseNode.get_height(root.left) - BaseNode.get_height(root.right)
+
+    def rebalance(self):
+        self.update_height()
+        left = self.left
+        right = self.right
+        factor = (0 if left is None else left.height) - (0 if right is None else right.height)
+
+        if factor == -2:
+            if self.get_factor(right) > 0:
+                self.right = right.right_rotate()
+            return self.left_rotate()
+        if factor == 2:
+            if self.get_factor(left) < 0:
+                self.left = left.left_rotate()
+            return self.right_rotate()
+        return self
+
+    @classmethod
+    def insert(cls, root, key, value=None):
+        if root is None:
+            return cls.make(key, value), True
+
+        if key < root.key:
+            root.left, res = cls.insert(root.left, key, value)
+        elif key > root.key:
+            root.right, res = cls.insert(root.right, key, value)
+        else:
+            root.set_value(value)
+            return root, False
+
+        return root.rebalance(), res
+
+    @staticmethod
+    def find(root, key):
+        while root is not None:
+            if key < root.key:
+                root = root.left
+            elif key > root.key:
+                root = root.right
+            else:
+                return root
+        return None
+
+    @staticmethod
+    def get_min_node(root):
+        while root.left is not None:
+            root = root.left
+        return root
+
+    @staticmethod
+    def get_max_node(root):
+        while root.right is not None:
+            root = root.right
+        return root
+
+    def erase_min(self):
+        # returns the new subtree root and the detached minimum node
+        if self.left is None:
+            return self.right, self
+        self.left, result = self.left.erase_min()
+        return self.rebalance(), result
+
+    def erase_max(self):
+        if self.right is None:
+            return self.left, self
+        self.right, result = self.right.erase_max()
+        return self.rebalance(), result
+
+    @classmethod
+    def erase(cls, root, key):
+        if root is None:
+            return None, False
+
+        if key < root.key:
+            root.left, res = cls.erase(root.left, key)
+        elif key > root.key:
+            root.right, res = cls.erase(root.right, key)
+        else:
+            if root.right is None:
+                return root.left, True
+            root.right, successor = root.right.erase_min()
+            root.copy_item(successor)
+            res = True
+
+        return root.rebalance(), res
+
+    @classmethod
+    def in_order(cls, root, function):
+        if root is None:
+            return
+        cls.in_order(root.left, function)
+        function(root)
+        cls.in_order(root.right, function)
+
+    @classmethod
+    def pre_order(cls, root, function):
+        if root is None:
+            return
+        function(root)
+        cls.pre_order(root.left, function)
+        cls.pre_order(root.right, function)
+
+    @classmethod
+    def post_order(cls, root, function):
+        if root is None:
+            return
+        cls.post_order(root.left, function)
+        cls.post_order(root.right, function)
+        function(root)
+
+    @classmethod
+    def sorted_arr_to_avl(cls, arr, start, end):
+        if start > end:
+            return None
+
+        mid = start + (end - start) // 2
+        root = cls.from_item(arr[mid])
+        root.left = cls.sorted_arr_to_avl(arr, start, mid - 1)
+        root.right = cls.sorted_arr_to_avl(arr, mid + 1, end)
+        root.update_height()
+        return root
+
+    @staticmethod
+    def link_sorted(nodes, start, end):
+        # like sorted_arr_to_avl, but relinks existing nodes instead of allocating
+        if start > end:
+            return None
+
+        mid = start + (end - start) // 2
+        root = nodes[mid]
+        root.left = BaseNode.link_sorted(nodes, start, mid - 1)
+        root.right = BaseNode.link_sorted(nodes, mid + 1, end)
+        root.update_height()
+        return root
+
+    @staticmethod
+    def join_with_root(left, mid, right):
+        # all keys in left < mid.key < all keys in right
+        left_height = BaseNode.get_height(left)
+        right_height = BaseNode.get_height(right)
+
+        if left_height > right_height + 1:
+            left.right = BaseNode.join_with_root(left.right, mid, right)
+            return left.rebalance()
+        if right_height > left_height + 1:
+            right.left = BaseNode.join_with_root(left, mid, right.left)
+            return right.rebalance()
+
+        mid.left = left
+        mid.right = right
+        mid.update_height()
+        return mid
+
+    @staticmethod
+    def concat(t1, t2):
+        # all keys in t1 < all keys in t2
+        if t1 is None:
+            return t2
+        if t2 is None:
+            return t1
+
+        t2, mid = t2.erase_min()
+        return BaseNode.join_with_root(t1, mid, t2)
+
+    @staticmethod
+    def split(root, key, inclusive=True):
+        # left part gets keys <= key (< key if not inclusive)
+        if root is None:
+            return None, None
+
+        if root.key < key or (inclusive and root.key == key):
+            left, right = BaseNode.split(root.right, key, inclusive)
+            return BaseNode.join_with_root(root.left, root, left), right
+        else:
+            left, right = BaseNode.split(root.left, key, inclusive)
+            return left, BaseNode.join_with_root(right, root, root.right)
+
+    @staticmethod
+    def search(root, key, below, strict):
+        # closest node below (or above) key; strict excludes key itself
+        result = None
+        while root is not None:
+            if root.key == key and not strict:
+                return root
+            if below:
+                if root.key < key:
+                    result = root
+                    root = root.right
+                else:
+                    root = root.left
+            else:
+                if root.key > key:
+                    result = root
+                    root = root.left
+                else:
+                    root = root.right
+        return result
+
+    @staticmethod
+    def search_many(root, probes, lo, hi, below, strict, candidate, out):
+        # answers search() for the sorted probes[lo:hi] that all lie in root's
+        # subtree range, descending each shared path only once
+        if lo == hi:
+            return
+        if root is None:
+            for i in range(lo, hi):
+                out[i] = candidate
+            return
+
+        if below != strict:
+            mid = bisect_left(probes, root.key, lo, hi)
+        else:
+            mid = bisect_right(probes, root.key, lo, hi)
+
+        if below:
+            BaseNode.search_many(root.left, probes, lo, mid, below, strict, candidate, out)
+            BaseNode.search_many(root.right, probes, mid, hi, below, strict, root, out)
+        else:
+            BaseNode.search_many(root.left, probes, lo, mid, below, strict, root, out)
+            BaseNode.search_many(root.right, probes, mid, hi, below, strict, candidate, out)
+
+    @staticmethod
+    def join(t1, t2):
+        nodes1 = []
+        BaseNode.in_order(t1, nodes1.append)
+        nodes2 = []
+        BaseNode.in_order(t2, nodes2.append)
+
+        nodes = []
+        i = 0
+        j = 0
+        while i < len(nodes1) and j < len(nodes2):
+            if nodes1[i].key < nodes2[j].key:
+                nodes.append(nodes1[i])
+                i += 1
+            else:
+                nodes.append(nodes2[j])
+                j += 1
+        nodes += nodes1[i:]
+        nodes += nodes2[j:]
+
+        return BaseNode.link_sorted(nodes, 0, len(nodes) - 1)
+
+
+class BufferedTree(ABC):
+    # Backend-independent layer shared by the AVL trees and BTreeMap: the
+    # bulk_loading() buffer and the nearest-key queries. Subclasses store the
+    # elements and implement the abstract hooks.
+
+    def __init__(self):
+        self.len = 0
+        self.pending = None
+        # change of len the buffered writes will make
+        self.pending_delta = 0
+
+    @abstractmethod
+    def insert(self, *item):
+        pass
+
+    @abstractmethod
+    def _contains_key(self, key):
+        pass
+
+    @abstractmethod
+    def _apply_pending(self, pending):
+        # pending is a sorted list of (key, value or ERASED); sets root and len
+        pass
+
+    @abstractmethod
+    def _search(self, key, below, strict):
+        # the item with the nearest key below or above key, or None
+        pass
+
+    @staticmethod
+    @abstractmethod
+    def _item_key(item):
+        pass
+
+    def __len__(self) -> int:
+        if not self.pending:
+            return self.len
+        return self.len + self.pending_delta
+
+    def __contains__(self, key) -> bool:
+        if self.pending and key in self.pending:
+            return self.pending[key] is not ERASED
+        return self._contains_key(key)
+
+    def _buffer(self, key, value):
+        # returns True if the write went to the bulk_loading() buffer
+        if self.pending is None:
+            return False
+        if key in self.pending:
+            existed = self.pending[key] is not ERASED
+        else:
+            existed = self._contains_key(key)
+        self.pending_delta += int(value is not ERASED) - int(existed)
+        self.pending[key] = value
+        return True
+
+    @contextmanager
+    def bulk_loading(self):
+        # inserts and erases are buffered and applied with a single rebuild on
+        # exit. Only get, in and len read through the buffer; every other read
+        # (floor, get_min, items, split, ...) calls _flush() first, which
+        # rebuilds the whole tree in O(n), so mixing such reads with writes in
+        # the block is slower than not buffering at all
+        if self.pending is not None:
+            yield self
+            return
+
+        self.pending = {}
+        self.pending_delta = 0
+        try:
+            yield self
+        finally:
+            self._flush()
+            self.pending = None
+
+    def _flush(self):
+        if not self.pending:
+            return
+
+        pending = sorted(self.pending.items(), key=lambda item: item[0])
+        self.pending = {}
+        self.pending_delta = 0
+        self._apply_pending(pending)
+
+    def _search_many(self, probes, below, strict):
+        if any(probes[i] > probes[i + 1] for i in range(len(probes) - 1)):
+            raise ValueError("Probes must be sorted")
+        return [self._search(probe, below, strict) for probe in probes]
+
+    def floor(self, key):
+        return self._search(key, below=True, strict=False)
+
+    def lower(self, key):
+        return self._search(key, below=True, strict=True)
+
+    def ceiling(self, key):
+        return self._search(key, below=False, strict=False)
+
+    def higher(self, key):
+        return self._search(key, below=False, strict=True)
+
+    @staticmethod
+    def _check_distance(key):
+        # nearest compares key - floor with ceiling - key, so keys must subtract
+        try:
+            key - key
+        except TypeError:
+            raise TypeError(f"nearest needs keys that support subtraction, not {type(key).__name__}") from None
+
+    def _pick_nearest(self, key, below, above):
+        # ties go to the smaller key
+        if below is None or above is None:
+            return above if below is None else below
+        if key - self._item_key(below) <= self._item_key(above) - key:
+            return below
+        return above
+
+    def nearest(self, key):
+        self._check_distance(key)
+        return self._pick_nearest(key, self.floor(key), self.ceiling(key))
+
+    def floor_many(self, probes):
+        return self._search_many(probes, below=True, strict=False)
+
+    def lower_many(self, probes):
+        return self._search_many(probes, below=True, strict=True)
+
+    def ceiling_many(self, probes):
+        return self._search_many(probes, below=False, strict=False)
+
+    def higher_many(self, probes):
+        return self._search_many(probes, below=False, strict=True)
+
+    def nearest_many(self, probes):
+        for probe in probes:
+            self._check_distance(probe)
+        return [
+            self._pick_nearest(probe, below, above)
+            for probe, below, above in zip(probes, self.floor_many(probes), self.ceiling_many(probes))
+        ]
+
+
+class BalancedTree(BufferedTree):
+    # Tree-level operations shared by AVLTree and AVLTreeMap; subclasses set
+    # Node to a concrete BaseNode subclass.
+
+    def __init__(self):
+        super().__init__()
+        self.root = None
+
+    def _contains_key(self, key):
+        return self.Node.find(self.root, key) is not None
+
+    def _item_key(self, item):
+        return self.Node.item_key(item)
+
+    def _insert(self, key, value):
+        if self._buffer(key, value):
+            return
+        self.root, res = self.Node.insert(self.root, key, value)
+        self.len += int(res)
+
+    def erase(self, key):
+        if self._buffer(key, ERASED):
+            return
+        self.root, res = self.Node.erase(self.root, key)
+        self.len -= int(res)
+
+    def _apply_pending(self, pending):
+        current = []
+        self.Node.in_order(self.root, current.append)
+
+        nodes = []
+        i = 0
+        j = 0
+        while i < len(current) or j < len(pending):
+            if j == len(pending) or (i < len(current) and current[i].key < pending[j][0]):
+                nodes.append(current[i])
+                i += 1
+                continue
+
+            key, value = pending[j]
+            j += 1
+            if i < len(current) and current[i].key == key:
+                node = current[i]
+                i += 1
+                if value is not ERASED:
+                    node.set_value(value)
+                    nodes.append(node)
+            elif value is not ERASED:
+                nodes.append(self.Node.make(key, value))
+
+        self.root = self.Node.link_sorted(nodes, 0, len(nodes) - 1)
+        self.len = len(nodes)
+
+    def erase_min(self):
+        self._flush()
+        if self.root is None:
+            raise RuntimeError("Tree is empty")
+        self.root, node = self.root.erase_min()
+        self.len -= 1
+        return node.item()
+
+    def erase_max(self):
+        self._flush()
+        if self.root is None:
+            raise RuntimeError("Tree is empty")
+        self.root, node = self.root.erase_max()
+        self.len -= 1
+        return node.item()
+
+    def get_min(self):
+        self._flush()
+        if self.root is None:
+            raise RuntimeError("Tree is empty")
+        return self.Node.get_min_node(self.root).item()
+
+    def get_max(self):
+        self._flush()
+        if self.root is None:
+            raise RuntimeError("Tree is empty")
+        return self.Node.get_max_node(self.root).item()
+
+    def _search(self, key, below, strict):
+        self._flush()
+        node = self.Node.search(self.root, key, below, strict)
+        return None if node is None else node.item()
+
+    def _search_many(self, probes, below, strict):
+        # one descent answers all probes
+        if any(probes[i] > probes[i + 1] for i in range(len(probes) - 1)):
+            raise ValueError("Probes must be sorted")
+        self._flush()
+        out = [None] * len(probes)
+        self.Node.search_many(self.root, probes, 0, len(probes), below, strict, None, out)
+        return [None if node is None else node.item() for node in out]
+
+    def rank(self, key):
+        # number of keys < key
+        self._flush()
+        n = 0
+        node = self.root
+        while node is not None:
+            if node.key < key:
+                n += self.Node.get_size(node.left) + 1
+                node = node.right
+            else:
+                node = node.left
+        return n
+
+    def key_at(self, index):
+        self._flush()
+        node = self.root
+        while node is not None:
+            left_size = self.Node.get_size(node.left)
+            if index < left_size:
+                node = node.left
+            elif index == left_size:
+                return node.key
+            else:
+                index -= left_size + 1
+                node = node.right
+        raise IndexError("Index out of range")
+
+    @staticmethod
+    def _typecode(items):
+        # array typecode for to_shared_memory, or None if items do not fit one
+        if all(type(item) is int and INT64_MIN <= item <= INT64_MAX for item in items):
+            return "q"
+        if all(type(item) is float for item in items):
+            return "d"
+        return None
+
+    @classmethod
+    def _from_root(cls, root):
+        tree = cls()
+        tree.root = root
+        tree.len = BaseNode.get_size(root)
+        return tree
+
+    def _like(self, root):
+        # a tree holding root with the same settings as self
+        return self._from_root(root)
+
+    def split(self, x):
+        self._flush()
+        left, right = self.Node.split(self.root, x)
+        return self._like(left), self._like(right)
+
+    def pop_range(self, lo, hi):
+        self._flush()
+        left, rest = self.Node.split(self.root, lo, inclusive=False)
+        middle, right = self.Node.split(rest, hi, inclusive=False)
+        self.root = self.Node.concat(left, right)
+        self.len = self.Node.get_size(self.root)
+        return self._like(middle)
+
+    def erase_range(self, lo, hi):
+        self.pop_range(lo, hi)
+
+    def join(self, other):
+        self._flush()
+        other._flush()
+        if (self.root is None or other.root is None or
+                self.Node.get_max_node(self.root).key < self.Node.get_min_node(other.root).key):
+            new_root = self.Node.concat(self.root, other.root)
+        else:
+            new_root = self.Node.join(self.root, other.root)
+        self.root = new_root
+        self.len = self.Node.get_size(new_root)
+        other.root = None
+        other.len = 0
+
+    def items(self):
+        self._flush()
+        stack = []
+        node = self.root
+        while stack or node is not None:
+            if node is not None:
+                stack.append(node)
+                node = node.left
+            else:
+                node = stack.pop()
+                yield node.item()
+                node = node.right
+
+    def __copy__(self):
+        self._flush()
+
+        def copy_node(node):
+            if node is None:
+                return None
+            new = self.Node.from_item(node.item())
+            new.left = copy_node(node.left)
+            new.right = copy_node(node.right)
+            new.height = node.height
+            new.size = node.size
+            return new
+
+        return self._like(copy_node(self.root))
+
+    def __str__(self):
+        self._flush()
+
+        def node_to_str(node):
+            if node is None:
+                return ""
+            result = ""
+            if node.left is not None:
+                result += f"{node.key} -- {node.left.key} [label=L]\n"
+                result += node_to_str(node.left)
+            if node.right is not None:
+                result += f"{node.key} -- {node.right.key} [label=R]\n"
+                result += node_to_str(node.right)
+            return result
+
+        return f"strict graph {{\n{node_to_str(self.root)}}}"
@@ -1,308 +1,80 @@
-class AVLTree:
-    class Node:
-        def __init__(
-                self,
-                val: int,
-                left = None, 
-                right = None,
-                height: int = 0
-            ):
-            self.val = val
-            self.left = left
-            self.right = right
-            self.height = height
+from array import array
+from multiprocessing.shared_memory import SharedMemory
 
-        def update_height(self):
-            self.height = 1 + max(AVLTree.Node.get_height(self.left), AVLTree.Node.get_height(self.right))
+from avl_core import BalancedTree, BaseNode
 
-        def right_rotate(self):
-            child = self.left
-            mid = child.right
 
-            child.right = self
-            self.left = mid
+class AVLTree(BalancedTree):
+    class Node(BaseNode):
+        # a set element is its key, so the node carries no value slot
+        __slots__ = ()
 
-            self.update_height()
-            child.update_height()
-            return child
+        @property
+        def val(self):
+            return self.key
 
-        def left_rotate(self):
-            child = self.right
-            mid = child.left
+        @classmethod
+        def make(cls, key, value):
+            return cls(key)
 
-            child.left = self
-            self.right = mid
-
-            self.update_height()
-            child.update_height()
-            return child
-
-        @staticmethod
-        def get_height(root): 
-            return 0 if root is None else root.height
-
-        @staticmethod
-        def get_factor(root): 
-            return 0 if root is None else AVLTree.Node.get_height(root.left) - AVLTree.Node.get_height(root.right)
-
-        def rebalance(self):
-            self.update_height()
-            factor = self.get_factor(self)
-
-            if factor == -2:
-                if self.get_factor(self.right) > 0:
-                    self.right = self.right.right_rotate()
-                return self.left_rotate()
-            if factor == 2:
-                if self.get_factor(self.left) < 0:
-                    self.left = self.left.left_rotate()
-                return self.right_rotate()
-            return self
+        @classmethod
+        def from_item(cls, item):
+            return cls(item)
 
         @staticmethod
-        def insert(root, val: int): 
-            if root is None:
-                return AVLTree.Node(val), True
-
-            res = False
-            if val < root.val:
-                root.left, res = AVLTree.Node.insert(root.left, val)
-            elif val > root.val:
-                root.right, res = AVLTree.Node.insert(root.right, val)
-            else:
-                return root, False
-
-            return root.rebalance(), res
+        def item_key(item):
+            return item
 
-        def clear(self):
-            if self.left is not None:
-                self.left.clear()
-            if self.right is not None:
-                self.right.clear()
-
-            del self
-
-        @staticmethod
-        def get_min_node(root):
-            while root.left is not None:
-                root = root.left
-            
-            return root
+        def item(self):
+            return self.key
 
-        def get_max_node(root):
-            while root.right is not None:
-                root = root.right
+        def set_value(self, value):
+            pass
 
-            return root
-
-        def erase_min(self):
-            if self.left is None:
-                right = self.right
-                result = self.val
-                del self
-                return right, result
-            
-            self.left, result = self.left.erase_min()
-            return self.rebalance(), result
-
-        def erase_max(self):
-            if self.right is None:
-                left = self.left
-                result = self.val
-                del self
-                return left, result
-            
-            self.right, result = self.right.erase_max()
-            return self.rebalance(), result
-
-        @staticmethod
-        def erase(root, val): 
-            if root is None:
-                return None, False
-
-            res = False
-            if val < root.val:
-                root.left, res = AVLTree.Node.erase(root.left, val)
-            elif val > root.val:
-                root.right, res = AVLTree.Node.erase(root.right, val)
-            else:
-                res = True
-                if root.right is None:
-                    left = root.left
-                    del root
-                    return left, res
-
-                root.right, new_val = root.right.erase_min()
-                root.val = new_val
-
-            return root.rebalance(), res
-
-        @staticmethod
-        def in_order(root, function):
-            if root is None:
-                return
-             
-            AVLTree.Node.in_order(root.left, function)
-            function(root)
-            AVLTree.Node.in_order(root.right, function)
-        
-        @staticmethod
-        def pre_order(root, function):
-            if root is None:
-                return
-             
-            function(root)
-            AVLTree.Node.pre_order(root.left, function)
-            AVLTree.Node.pre_order(root.right, function)
-
-        @staticmethod
-        def post_order(root, function):
-            if root is None:
-                return
-             
-            AVLTree.Node.post_order(root.left, function)
-            AVLTree.Node.post_order(root.right, function)
-            function(root)
-
-        @staticmethod
-        def sorted_arr_to_avl(arr, start, end):
-            if start > end:
-                return None
-
-            mid = start + (end - start) // 2
-            root = AVLTree.Node(arr[mid])
-            root.left = AVLTree.Node.sorted_arr_to_avl(arr, start, mid - 1)
-            root.right = AVLTree.Node.sorted_arr_to_avl(arr, mid + 1, end)
-            return root
-
-        @staticmethod
-        def join(t1, t2):
-            arr1 = []
-            AVLTree.Node.in_order(t1, lambda node: arr1.append(node.val))
-            arr2 = []
-            AVLTree.Node.in_order(t2, lambda node: arr2.append(node.val))
-
-            arr = []
-            i = 0
-            j = 0
-            while i < len(arr1) and j < len(arr2):
-                if arr1[i] < arr2[j]:
-                    arr.append(arr1[i])
-                    i += 1
-                else:
-                    arr.append(arr2[j])
-                    j += 1
-            
-            while i < len(arr1):
-                arr.append(arr1[i])
-                i += 1
-            
-            while j < len(arr2):
-                arr.append(arr2[j])
-                j += 1
-            
-            return AVLTree.Node.sorted_arr_to_avl(arr, 0, len(arr) - 1)
-
-    def __init__(self):
-        self.root = None
-        self.len = 0
-
-    def __len__(self) -> int:
-        return self.len
+        def copy_item(self, other):
+            self.key = other.key
 
     def insert(self, val: int):
-        self.root, res = AVLTree.Node.insert(self.root, val)
-        self.len += int(res)
-
-    def erase(self, val: int):
-        self.root, res = AVLTree.Node.erase(self.root, val)
-        self.len -= int(res)
-
-    def erase_min(self):
-        if self.root is None:
-            raise RuntimeError("Tree is empty")
-        self.root, result = self.root.erase_min()
-        return result
+        self._insert(val, None)
 
-    def erase_max(self):
-        if self.root is None:
-            raise RuntimeError("Tree is empty")
-        self.root, result = self.root.erase_max()
-        return result
-
-    def get_min(self):
-        while self.left is not None:
-            self = self.left
-        return self
-    
-    def get_max(self):
-        while self.right is not None:
-            self = self.right
-        return self
+    def to_list(self):
+        return list(self.items())
 
     @staticmethod
-    def _count_nodes(root):
-        if root is None:
-            return 0
-        return 1 + AVLTree._count_nodes(root.left) + AVLTree._count_nodes(root.right)
-
-    def join(self, other):
-        new_root = self.Node.join(self.root, other.root)
-        self.root = new_root
-        self.len = self._count_nodes(new_root)
-        other.root = None
-        other.len = 0
-
-    def split(self, x):
-        def _split(node):
-            if not node:
-                return (None, None)
-            
-            if node.val <= x:
-                left, right = _split(node.right)
-                node.right = left
-                AVLTree.Node.update_height(node)
-                return (AVLTree.Node.rebalance(node), right)
-            else:
-                left, right = _split(node.left)
-                node.left = right
-                AVLTree.Node.update_height(node)
-                return (left, AVLTree.Node.rebalance(node))
-
-        left_tree = AVLTree()
-        right_tree = AVLTree()
-        left_tree.root, right_tree.root = _split(self.root)
-        return left_tree, right_tree
-
-
-    def __del__(self):
-        if self.root is not None:
-            self.root.clear()
+    def from_sorted(arr):
+        return AVLTree._from_root(AVLTree.Node.sorted_arr_to_avl(arr, 0, len(arr) - 1))
+
+    def __getstate__(self):
+        return (self.to_list(),)
+
+    def __setstate__(self, state):
+        arr, = state
+        self.root = AVLTree.Node.sorted_arr_to_avl(arr, 0, len(arr) - 1)
+        self.len = len(arr)
+        self.pending = None
+
+    def to_shared_memory(self):
+        # the caller owns the returned block and must close() and unlink() it
+        arr = self.to_list()
+        typecode = self._typecode(arr)
+        if typecode is None:
+            raise TypeError("Only int64 or float values can be shared")
+
+        data = array(typecode, arr)
+        shm = SharedMemory(create=True, size=max(1, len(data) * data.itemsize))
+        shm.buf[:len(data) * data.itemsize] = data.tobytes()
+        return shm, (shm.name, typecode, len(data))
 
-    def __copy__(self):
-        def copy_node(node):
-            if node is None:
-                return None
-            return AVLTree.Node(node.val, copy_node(node.left), copy_node(node.right), node.height)
-
-        new_tree = AVLTree()
-        new_tree.root = copy_node(self.root)
-        return new_tree
-
-    def __deepcopy__(self):
+    @staticmethod
+    def from_shared_memory(handle):
+        name, typecode, n = handle
+        shm = SharedMemory(name=name)
+        try:
+            data = array(typecode)
+            data.frombytes(shm.buf[:n * data.itemsize])
+        finally:
+            shm.close()
+        return AVLTree.from_sorted(data.tolist())
+
+    def __deepcopy__(self, memo=None):
         return self.__copy__()
-
-    def __str__(self):
-        def node_to_str(node):
-            if node is None:
-                return ""
-            result = ""
-            if node.left is not None:
-                result += f"{node.val} -- {node.left.val} [label=L]\n"
-                result += node_to_str(node.left)
-            if node.right is not None:
-                result += f"{node.val} -- {node.right.val} [label=R]\n"
-                result += node_to_str(node.right)
-            return result
-
-        return f"strict graph {{\n{node_to_str(self.root)}}}"
@@ -0,0 +1,67 @@
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "map"))
+
+from avl_tree import AVLTree
+from avl_map import AVLTreeMap
+
+
+def fill(tree, keys):
+    if isinstance(tree, AVLTreeMap):
+        for key in keys:
+            tree.insert(key, key)
+    else:
+        for key in keys:
+            tree.insert(key)
+
+
+def measure(name, make, n):
+    keys = list(range(n))
+    random.shuffle(keys)
+
+    # tracemalloc slows allocation down, so memory is measured on a separate build
+    tracemalloc.start()
+    tree = make()
+    fill(tree, keys)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del tree
+
+    start = time.perf_counter()
+    tree = make()
+    fill(tree, keys)
+    insert_time = time.perf_counter() - start
+
+    random.shuffle(keys)
+    start = time.perf_counter()
+    for key in keys:
+        key in tree
+    lookup_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for key in keys:
+        tree.erase(key)
+    erase_time = time.perf_counter() - start
+
+    print(f"{name:>10}: insert {n / insert_time:>8.0f} ops/s, "
+          f"lookup {n / lookup_time:>8.0f} ops/s, "
+          f"erase {n / erase_time:>8.0f} ops/s, "
+          f"memory {memory / n:>6.1f} B/element")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure AVLTree and AVLTreeMap throughput and memory")
+    parser.add_argument("-n", type=int, default=100000)
+    args = parser.parse_args()
+
+    measure("AVLTree", AVLTree, args.n)
+    measure("AVLTreeMap", AVLTreeMap, args.n)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
+import multiprocessing
 import os
+import pickle
 import random
 import pytest
 from avl_tree import AVLTree
+from avl_core import BalancedTree, BaseNode
 
 N_ELEMENTS = 30
 
@@ -114,6 +117,23 @@ def test_erase_minmax_empty():
     with pytest.raises(RuntimeError):
         tree.erase_max()
 
+def test_get_minmax(avl_tree_and_set):
+    avl, ref_set = avl_tree_and_set
+    assert avl.get_min() == 0
+    assert avl.get_max() == N_ELEMENTS - 1
+    check_elements(avl, ref_set)
+
+def test_node_has_no_value():
+    node = AVLTree.Node(1)
+    assert not hasattr(node, "__dict__")
+    assert not hasattr(node, "value")
+
+def test_abstract_core():
+    with pytest.raises(TypeError):
+        BalancedTree()
+    with pytest.raises(TypeError):
+        BaseNode(1)
+
 def test_erase_empty():
     tree = AVLTree()
     assert tree.erase(42) is None
@@ -159,8 +179,163 @@ def test_split():
 
     avl1, avl2 = avl.split(N_ELEMENTS // 3)
 
+    is_avl(avl1.root)
+    is_avl(avl2.root)
+    check_elements(avl1, set(range(N_ELEMENTS // 3 + 1)))
+    check_elements(avl2, set(range(N_ELEMENTS // 3 + 1, N_ELEMENTS)))
+    assert len(avl1) == N_ELEMENTS // 3 + 1
+    assert len(avl2) == N_ELEMENTS - N_ELEMENTS // 3 - 1
+
     draw_tree(avl1, "draw/split1")
     draw_tree(avl2, "draw/split2")
 
+def test_erase_range(avl_tree_and_set):
+    avl, ref_set = avl_tree_and_set
+    lo, hi = N_ELEMENTS // 4, N_ELEMENTS // 2
+    avl.erase_range(lo, hi)
+    ref_set -= set(range(lo, hi))
+
+    is_avl(avl.root)
+    check_elements(avl, ref_set)
+    assert len(avl) == len(ref_set)
+    draw_tree(avl, "draw/erase-range")
+
+def test_pop_range():
+    avl = AVLTree()
+    ref_set = set()
+    for _ in range(1000):
+        x = random.randint(0, 10 * N_ELEMENTS)
+        avl.insert(x)
+        ref_set.add(x)
+
+    for _ in range(N_ELEMENTS):
+        lo = random.randint(0, 10 * N_ELEMENTS)
+        hi = lo + random.randint(0, 3 * N_ELEMENTS)
+        popped = avl.pop_range(lo, hi)
+        removed = {x for x in ref_set if lo <= x < hi}
+        ref_set -= removed
+
+        is_avl(avl.root)
+        is_avl(popped.root)
+        check_elements(avl, ref_set)
+        check_elements(popped, removed)
+        assert len(avl) == len(ref_set)
+        assert len(popped) == len(removed)
+
+def test_pickle():
+    avl = AVLTree()
+    for i in range(20000):
+        avl.insert(i)
+
+    restored = pickle.loads(pickle.dumps(avl))
+    is_avl(restored.root)
+    assert len(restored) == len(avl)
+    assert restored.to_list() == avl.to_list()
+
+    empty = pickle.loads(pickle.dumps(AVLTree()))
+    assert empty.root is None
+    assert len(empty) == 0
+
+def _shared_sum(handle):
+    return sum(AVLTree.from_shared_memory(handle).to_list())
+
+def test_shared_memory():
+    avl = AVLTree()
+    ref_set = set()
+    for _ in range(1000):
+        x = random.randint(-N_ELEMENTS ** 3, N_ELEMENTS ** 3)
+        avl.insert(x)
+        ref_set.add(x)
+
+    shm, handle = avl.to_shared_memory()
+    try:
+        restored = AVLTree.from_shared_memory(handle)
+        is_avl(restored.root)
+        check_elements(restored, ref_set)
+        assert len(restored) == len(ref_set)
+
+        with multiprocessing.Pool(1) as pool:
+            assert pool.apply(_shared_sum, (handle,)) == sum(ref_set)
+    finally:
+        shm.close()
+        shm.unlink()
+
+def test_shared_memory_bad_type():
+    avl = AVLTree()
+    avl.insert("a")
+    with pytest.raises(TypeError):
+        avl.to_shared_memory()
+
+    avl = AVLTree()
+    avl.insert(2 ** 70)
+    with pytest.raises(TypeError):
+        avl.to_shared_memory()
+
+def reference_search(values, x):
+    below = [v for v in values if v <= x]
+    strictly_below = [v for v in values if v < x]
+    above = [v for v in values if v >= x]
+    strictly_above = [v for v in values if v > x]
+
+    floor = max(below, default=None)
+    ceiling = min(above, default=None)
+    if floor is None or ceiling is None:
+        nearest = ceiling if floor is None else floor
+    else:
+        nearest = floor if x - floor <= ceiling - x else ceiling
+
+    return {
+        "floor": floor,
+        "lower": max(strictly_below, default=None),
+        "ceiling": ceiling,
+        "higher": min(strictly_above, default=None),
+        "nearest": nearest,
+    }
+
+def test_search():
+    avl = AVLTree()
+    ref_set = set()
+    for _ in range(N_ELEMENTS):
+        x = random.randint(0, 10 * N_ELEMENTS) * 2
+        avl.insert(x)
+        ref_set.add(x)
+
+    probes = list(range(-3, 20 * N_ELEMENTS + 3))
+    expected = [reference_search(ref_set, x) for x in probes]
+    for query in ("floor", "lower", "ceiling", "higher", "nearest"):
+        assert [getattr(avl, query)(x) for x in probes] == [e[query] for e in expected]
+        assert getattr(avl, f"{query}_many")(probes) == [e[query] for e in expected]
+
+    assert AVLTree().floor(1) is None
+    assert AVLTree().nearest_many([1, 2]) == [None, None]
+    with pytest.raises(ValueError):
+        avl.floor_many([2, 1])
+
+def test_bulk_loading(avl_tree_and_set):
+    avl, ref_set = avl_tree_and_set
+    with avl.bulk_loading():
+        for _ in range(1000):
+            x = random.randint(0, 10 * N_ELEMENTS)
+            if random.random() < 0.7:
+                avl.insert(x)
+                ref_set.add(x)
+            else:
+                avl.erase(x)
+                ref_set.discard(x)
+
+            assert (x in avl) == (x in ref_set)
+            assert len(avl) == len(ref_set)
+
+        assert avl.floor(5 * N_ELEMENTS) == max((x for x in ref_set if x <= 5 * N_ELEMENTS), default=None)
+        avl.insert(-1)
+        ref_set.add(-1)
+        assert len(avl) == len(ref_set)
+
+    assert avl.pending is None
+    is_avl(avl.root)
+    check_elements(avl, ref_set)
+    assert len(avl) == len(ref_set)
+    assert avl.to_list() == sorted(ref_set)
+
 if __name__ == "__main__":
     pytest.main()
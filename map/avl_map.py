@@ -1,268 +1,361 @@
-class AVLTreeMap:
-    class Node:
-        def __init__(self, key, value, left=None, right=None, height=0):
+import hashlib
+import pickle
+from array import array
+from multiprocessing.shared_memory import SharedMemory
+
+from sorted_map import SortedMap
+from avl_core import ERASED, BalancedTree, BaseNode
+from btree_map import BTreeMap
+from hot_cache import MISSING, HotCache
+
+# node hashes are summed modulo 2**128, so equal contents give equal hashes
+# no matter how the two trees are shaped
+HASH_BITS = 128
+HASH_MASK = (1 << HASH_BITS) - 1
+
+
+def _encode(obj, out):
+    # appends a canonical encoding of obj to out: equal objects get equal
+    # bytes in every process, whatever the hash seed or insertion order.
+    # 1, 1.0 and True encode the same, dicts and sets are sorted by encoding
+    if obj is None:
+        out.append(b"N")
+    elif isinstance(obj, (bool, int)) or (type(obj) is float and obj.is_integer()):
+        data = str(int(obj)).encode()
+        out.append(b"I%d:" % len(data) + data)
+    elif type(obj) is float:
+        data = repr(obj).encode()
+        out.append(b"F%d:" % len(data) + data)
+    elif isinstance(obj, str):
+        data = obj.encode("utf-8", "surrogatepass")
+        out.append(b"S%d:" % len(data) + data)
+    elif isinstance(obj, (bytes, bytearray)):
+        out.append(b"B%d:" % len(obj) + bytes(obj))
+    elif isinstance(obj, (tuple, list)):
+        out.append(b"%s%d:" % (b"T" if isinstance(obj, tuple) else b"L", len(obj)))
+        for item in obj:
+            _encode(item, out)
+    elif isinstance(obj, (set, frozenset)):
+        out.append(b"E%d:" % len(obj))
+        out.extend(sorted(_encoded(item) for item in obj))
+    elif isinstance(obj, dict):
+        out.append(b"D%d:" % len(obj))
+        out.extend(sorted(_encoded(key) + _encoded(value) for key, value in obj.items()))
+    else:
+        raise TypeError(f"Cannot hash {type(obj).__name__} values")
+
+
+def _encoded(obj):
+    out = []
+    _encode(obj, out)
+    return b"".join(out)
+
+
+class AVLTreeMap(BalancedTree, SortedMap):
+    class Node(BaseNode):
+        __slots__ = ("value", "hash")
+
+        def __init__(self, key, value, left=None, right=None, height=1, size=1):
             self.key = key
             self.value = value
             self.left = left
             self.right = right
             self.height = height
+            self.size = size
+            self.hash = None
 
-        def update_height(self):
-            self.height = 1 + max(AVLTreeMap.Node.get_height(self.left), AVLTreeMap.Node.get_height(self.right))
-
-        def right_rotate(self):
-            child = self.left
-            mid = child.right
-
-            child.right = self
-            self.left = mid
-
-            self.update_height()
-            child.update_height()
-            return child
-
-        def left_rotate(self):
-            child = self.right
-            mid = child.left
-
-            child.left = self
-            self.right = mid
-
-            self.update_height()
-            child.update_height()
-            return child
+        @classmethod
+        def make(cls, key, value):
+            return cls(key, value)
 
-        @staticmethod
-        def get_height(root):
-            return 0 if root is None else root.height
+        @classmethod
+        def from_item(cls, item):
+            return cls(item[0], item[1])
 
         @staticmethod
-        def get_balance_factor(root):
-            return 0 if root is None else AVLTreeMap.Node.get_height(root.left) - AVLTreeMap.Node.get_height(root.right)
-
-        def rebalance(self):
-            self.update_height()
-            factor = AVLTreeMap.Node.get_balance_factor(self)
-
-            if factor == -2:
-                if AVLTreeMap.Node.get_balance_factor(self.right) > 0:
-                    self.right = self.right.right_rotate()
-                return self.left_rotate()
-            if factor == 2:
-                if AVLTreeMap.Node.get_balance_factor(self.left) < 0:
-                    self.left = self.left.left_rotate()
-                return self.right_rotate()
-            return self
+        def item_key(item):
+            return item[0]
 
-        @staticmethod
-        def insert(root, key, value):
-            if root is None:
-                return AVLTreeMap.Node(key, value), True
+        def item(self):
+            return self.key, self.value
 
-            res = False
-            if key < root.key:
-                root.left, res = AVLTreeMap.Node.insert(root.left, key, value)
-            elif key > root.key:
-                root.right, res = AVLTreeMap.Node.insert(root.right, key, value)
-            else:
-                root.value = value
-                return root, False
-
-            return root.rebalance(), res
+        def set_value(self, value):
+            self.value = value
+            self.hash = None
 
-        def clear(self):
-            if self.left:
-                self.left.clear()
-            if self.right:
-                self.right.clear()
+        def copy_item(self, other):
+            self.key = other.key
+            self.value = other.value
 
-        @staticmethod
-        def erase_min(node):
-            if node.left is None:
-                return node.right, (node.key, node.value)
-            node.left, (min_key, min_value) = AVLTreeMap.Node.erase_min(node.left)
-            return node.rebalance(), (min_key, min_value)
+        def update_height(self):
+            # same as BaseNode.update_height, inlined to keep the hot path short
+            left = self.left
+            right = self.right
+            left_height = 0 if left is None else left.height
+            right_height = 0 if right is None else right.height
+            self.height = 1 + (left_height if left_height > right_height else right_height)
+            self.size = 1 + (0 if left is None else left.size) + (0 if right is None else right.size)
+            self.hash = None
 
         @staticmethod
-        def erase_max(node):
-            if node.right is None:
-                return node.left, (node.key, node.value)
-            node.right, (max_key, max_value) = AVLTreeMap.Node.erase_max(node.right)
-            return node.rebalance(), (max_key, max_value)
+        def item_hash(key, value):
+            data = _encoded((key, value))
+            return int.from_bytes(hashlib.blake2b(data, digest_size=HASH_BITS // 8).digest(), "little")
 
         @staticmethod
-        def erase(root, key):
+        def get_hash(root):
+            # hashes are computed lazily; any change resets them along its path
             if root is None:
-                return None, False
-
-            res = False
-            if key < root.key:
-                root.left, res = AVLTreeMap.Node.erase(root.left, key)
-            elif key > root.key:
-                root.right, res = AVLTreeMap.Node.erase(root.right, key)
-            else:
-                res = True
-                if root.right is None:
-                    left = root.left
-                    root.left = None
-                    root.clear()
-                    return left, res
-
-                root.right, (min_key, min_value) = AVLTreeMap.Node.erase_min(root.right)
-                root.key, root.value = min_key, min_value
-
-            return root.rebalance(), res
-
-        @staticmethod
-        def in_order(root, func):
-            if root:
-                AVLTreeMap.Node.in_order(root.left, func)
-                func(root)
-                AVLTreeMap.Node.in_order(root.right, func)
-
-        @staticmethod
-        def sorted_arr_to_avl(arr, start, end):
-            if start > end:
-                return None
-
-            mid = start + (end - start) // 2
-            root = AVLTreeMap.Node(arr[mid][0], arr[mid][1])
-            root.left = AVLTreeMap.Node.sorted_arr_to_avl(arr, start, mid - 1)
-            root.right = AVLTreeMap.Node.sorted_arr_to_avl(arr, mid + 1, end)
-            return root
-
-        @staticmethod
-        def join(t1, t2):
-            arr1 = []
-            AVLTreeMap.Node.in_order(t1, lambda node: arr1.append((node.key, node.value)))
-            arr2 = []
-            AVLTreeMap.Node.in_order(t2, lambda node: arr2.append((node.key, node.value)))
-
-            arr = []
-            i = 0
-            j = 0
-            while i < len(arr1) and j < len(arr2):
-                if arr1[i][0] < arr2[j][0]:
-                    arr.append(arr1[i])
-                    i += 1
-                else:
-                    arr.append(arr2[j])
-                    j += 1
-            
-            while i < len(arr1):
-                arr.append(arr1[i])
-                i += 1
-            
-            while j < len(arr2):
-                arr.append(arr2[j])
-                j += 1
-            
-            return AVLTreeMap.Node.sorted_arr_to_avl(arr, 0, len(arr) - 1)
-        
-    def __init__(self):
-        self.root = None
-        self.len = 0
-
-    def __len__(self):
-        return self.len
+                return 0
+            if root.hash is None:
+                root.hash = (
+                    AVLTreeMap.Node.item_hash(root.key, root.value) +
+                    AVLTreeMap.Node.get_hash(root.left) +
+                    AVLTreeMap.Node.get_hash(root.right)
+                ) & HASH_MASK
+            return root.hash
+
+    def __new__(cls, backend="avl", **options):
+        if backend == "btree":
+            if options.pop("hot_cache", 0):
+                raise ValueError("hot_cache is only supported by the avl backend")
+            return BTreeMap(**options)
+        if backend != "avl":
+            raise ValueError(f"Unknown backend {backend}")
+        return super().__new__(cls)
+
+    def __init__(self, backend="avl", hot_cache=0):
+        super().__init__()
+        # keys must be hashable to use the cache
+        self.hot = HotCache(hot_cache) if hot_cache else None
 
     def insert(self, key, value):
-        self.root, res = self.Node.insert(self.root, key, value)
-        self.len += int(res)
+        if self.hot is not None:
+            self.hot.discard(key)
+        self._insert(key, value)
 
     def erase(self, key):
-        self.root, res = self.Node.erase(self.root, key)
-        self.len -= int(res)
+        if self.hot is not None:
+            self.hot.discard(key)
+        super().erase(key)
 
     def get(self, key):
+        if self.pending and key in self.pending:
+            value = self.pending[key]
+            if value is ERASED:
+                raise KeyError(f"Key {key} not found")
+            return value
+
+        hot = self.hot
+        if hot is not None:
+            hot.reads += 1
+            hot.countdown -= 1
+            if hot.countdown == 0:
+                hot.sample(key)
+            value = hot.values.get(key, MISSING)
+            if value is not MISSING:
+                hot.hits += 1
+                return value
+
         node = self.root
-        while node:
+        while node is not None:
             if key < node.key:
                 node = node.left
             elif key > node.key:
                 node = node.right
             else:
+                if hot is not None and key in hot.keys:
+                    hot.values[key] = node.value
                 return node.value
         raise KeyError(f"Key {key} not found")
 
-    def __contains__(self, key):
-        try:
-            self.get(key)
-            return True
-        except KeyError:
-            return False
-
-    def get_min(self):
-        if self.root is None:
-            raise RuntimeError("Tree is empty")
-        node = self.root
-        while node.left is not None: node = node.left
-        return node.key, node.value
+    def hot_stats(self):
+        if self.hot is None:
+            raise RuntimeError("Hot cache is disabled")
+        return self.hot.stats()
 
-    def get_max(self):
-        if self.root is None:
-            raise RuntimeError("Tree is empty")
-        node = self.root
-        while node.right is not None: node = node.right
-        return node.key, node.value
+    def _like(self, root):
+        tree = super()._like(root)
+        if self.hot is not None:
+            tree.hot = HotCache(self.hot.capacity)
+        return tree
+
+    def _clear_hot(self):
+        if self.hot is not None:
+            self.hot.clear()
+
+    # the rest of the writes go through these, so they drop the whole cache
+
+    def _flush(self):
+        if self.pending:
+            self._clear_hot()
+        super()._flush()
 
-    def get_max(self):
-        if self.root is None:
-            raise RuntimeError("Tree is empty")
-        self.root, (key, value) = self.Node.erase_max(self.root)
-        self.len -= 1
-        return (key, value)
+    def erase_min(self):
+        self._clear_hot()
+        return super().erase_min()
+
+    def erase_max(self):
+        self._clear_hot()
+        return super().erase_max()
 
     def split(self, x):
-        def _split(node):
-            if node is None:
-                return (None, None)
-            if node.key <= x:
-                left, right = _split(node.right)
-                node.right = left
-                node.update_height()
-                return (node.rebalance(), right)
+        self._clear_hot()
+        return super().split(x)
+
+    def pop_range(self, lo, hi):
+        self._clear_hot()
+        return super().pop_range(lo, hi)
+
+    def join(self, other):
+        self._clear_hot()
+        other._clear_hot()
+        super().join(other)
+
+    def root_hash(self):
+        self._flush()
+        return self.Node.get_hash(self.root)
+
+    def _prefix_hash(self, key):
+        # hash and count of all items with keys < key
+        h = 0
+        n = 0
+        node = self.root
+        while node is not None:
+            if node.key < key:
+                h += self.Node.get_hash(node) - self.Node.get_hash(node.right)
+                n += self.Node.get_size(node.left) + 1
+                node = node.right
             else:
-                left, right = _split(node.left)
-                node.left = right
-                node.update_height()
-                return (left, node.rebalance())
-
-        left_tree = AVLTreeMap()
-        right_tree = AVLTreeMap()
-        left_tree.root, right_tree.root = _split(self.root)
-        left_tree.len = AVLTreeMap._count_nodes(left_tree.root)
-        right_tree.len = AVLTreeMap._count_nodes(right_tree.root)
-        return left_tree, right_tree
+                node = node.left
+        return h & HASH_MASK, n
+
+    def range_hash(self, lo=None, hi=None):
+        # hash and count of the items with lo <= key < hi; None means unbounded
+        self._flush()
+        lo_hash, lo_count = (0, 0) if lo is None else self._prefix_hash(lo)
+        if hi is None:
+            hi_hash, hi_count = self.Node.get_hash(self.root), self.len
+        else:
+            hi_hash, hi_count = self._prefix_hash(hi)
+        return (hi_hash - lo_hash) & HASH_MASK, hi_count - lo_count
+
+    def to_lists(self):
+        self._flush()
+        keys = []
+        values = []
+
+        def append(node):
+            keys.append(node.key)
+            values.append(node.value)
+
+        AVLTreeMap.Node.in_order(self.root, append)
+        return keys, values
 
     @staticmethod
-    def _count_nodes(root):
-        if root is None:
-            return 0
-        return 1 + AVLTreeMap._count_nodes(root.left) + AVLTreeMap._count_nodes(root.right)
+    def from_sorted(keys, values):
+        arr = list(zip(keys, values))
+        return AVLTreeMap._from_root(AVLTreeMap.Node.sorted_arr_to_avl(arr, 0, len(arr) - 1))
+
+    def __getstate__(self):
+        # the hot cache keeps its capacity but starts empty
+        keys, values = self.to_lists()
+        return keys, values, 0 if self.hot is None else self.hot.capacity
+
+    def __setstate__(self, state):
+        keys, values, hot_cache = state
+        arr = list(zip(keys, values))
+        self.root = AVLTreeMap.Node.sorted_arr_to_avl(arr, 0, len(arr) - 1)
+        self.len = len(arr)
+        self.pending = None
+        self.hot = HotCache(hot_cache) if hot_cache else None
+
+    def to_shared_memory(self):
+        # keys must be int64 or float; values that are not numeric are pickled
+        # as a single blob after the keys.
+        # the caller owns the returned block and must close() and unlink() it
+        keys, values = self.to_lists()
+        key_typecode = self._typecode(keys)
+        if key_typecode is None:
+            raise TypeError("Only int64 or float keys can be shared")
+
+        key_data = array(key_typecode, keys).tobytes()
+        value_typecode = self._typecode(values) or "p"
+        if value_typecode == "p":
+            value_data = pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL)
+        else:
+            value_data = array(value_typecode, values).tobytes()
+
+        shm = SharedMemory(create=True, size=max(1, len(key_data) + len(value_data)))
+        shm.buf[:len(key_data)] = key_data
+        shm.buf[len(key_data):len(key_data) + len(value_data)] = value_data
+        return shm, (shm.name, key_typecode, value_typecode, len(keys), len(value_data))
 
-    def join(self, other):
-        new_root = self.Node.join(self.root, other.root)
-        self.root = new_root
-        self.len = self._count_nodes(new_root)
-        other.root = None
-        other.len = 0
-
-    def __del__(self):
-        if self.root:
-            self.root.clear()
-
-    def __str__(self):
-        def node_to_str(node):
-            if node is None:
-                return ""
-            result = ""
-            if node.left is not None:
-                result += f"{node.key} -- {node.left.key} [label=L]\n"
-                result += node_to_str(node.left)
-            if node.right is not None:
-                result += f"{node.key} -- {node.right.key} [label=R]\n"
-                result += node_to_str(node.right)
-            return result
-
-        return f"strict graph {{\n{node_to_str(self.root)}}}"
+    @staticmethod
+    def from_shared_memory(handle):
+        name, key_typecode, value_typecode, n, value_size = handle
+        shm = SharedMemory(name=name)
+        try:
+            keys = array(key_typecode)
+            key_size = n * keys.itemsize
+            keys.frombytes(shm.buf[:key_size])
+            if value_typecode == "p":
+                values = pickle.loads(shm.buf[key_size:key_size + value_size])
+            else:
+                values = array(value_typecode)
+                values.frombytes(shm.buf[key_size:key_size + value_size])
+                values = values.tolist()
+        finally:
+            shm.close()
+        return AVLTreeMap.from_sorted(keys.tolist(), values)
+
+    @staticmethod
+    def _expand(stack):
+        # stack entries are (node, single): a lone node or its whole subtree
+        node, _ = stack.pop()
+        if node.right is not None:
+            stack.append((node.right, False))
+        stack.append((node, True))
+        if node.left is not None:
+            stack.append((node.left, False))
+
+    @staticmethod
+    def _drain(stack):
+        while stack:
+            if stack[-1][1]:
+                yield stack.pop()[0]
+            else:
+                AVLTreeMap._expand(stack)
+
+    def _diff_same(self, other):
+        # both trees are walked with explicit stacks, so memory depends only on
+        # their heights
+        self._flush()
+        other._flush()
+
+        left = [] if self.root is None else [(self.root, False)]
+        right = [] if other.root is None else [(other.root, False)]
+        while left and right:
+            a, a_single = left[-1]
+            b, b_single = right[-1]
+            if a_single and b_single:
+                if a.key < b.key:
+                    left.pop()
+                    yield "removed", a.key, a.value, None
+                elif b.key < a.key:
+                    right.pop()
+                    yield "added", b.key, None, b.value
+                else:
+                    left.pop()
+                    right.pop()
+                    if a.value != b.value:
+                        yield "changed", a.key, a.value, b.value
+            elif a_single or (not b_single and b.height > a.height):
+                self._expand(right)
+            else:
+                self._expand(left)
+
+        for node in self._drain(left):
+            yield "removed", node.key, node.value, None
+        for node in self._drain(right):
+            yield "added", node.key, None, node.value
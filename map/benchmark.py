@@ -0,0 +1,107 @@
+import argparse
+import random
+import time
+import tracemalloc
+
+from avl_map import AVLTreeMap
+
+
+def scan(tree):
+    if hasattr(tree, "items"):
+        for _ in tree.items():
+            pass
+    else:
+        AVLTreeMap.Node.in_order(tree.root, lambda node: None)
+
+
+def measure(name, n, **options):
+    keys = list(range(n))
+    random.shuffle(keys)
+
+    # tracemalloc slows allocation down, so memory is measured on a separate build
+    tracemalloc.start()
+    tree = AVLTreeMap(**options)
+    for key in keys:
+        tree.insert(key, key)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del tree
+
+    start = time.perf_counter()
+    tree = AVLTreeMap(**options)
+    for key in keys:
+        tree.insert(key, key)
+    insert_time = time.perf_counter() - start
+
+    random.shuffle(keys)
+    start = time.perf_counter()
+    for key in keys:
+        tree.get(key)
+    lookup_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scan(tree)
+    scan_time = time.perf_counter() - start
+
+    print(f"{name:>12}: insert {n / insert_time:>10.0f} ops/s, "
+          f"lookup {n / lookup_time:>10.0f} ops/s, "
+          f"scan {n / scan_time:>11.0f} keys/s, "
+          f"memory {memory / n:>6.1f} B/key")
+
+
+def zipf_keys(n, count, s):
+    # key ranks follow Zipf's law; ranks are shuffled so hot keys sit anywhere in the tree
+    keys = list(range(n))
+    random.shuffle(keys)
+    weights = [1 / rank ** s for rank in range(1, n + 1)]
+    return random.choices(keys, weights=weights, k=count)
+
+
+def measure_zipf(name, n, reads, s, hot_cache=0):
+    tree = AVLTreeMap(hot_cache=hot_cache)
+    keys = list(range(n))
+    random.shuffle(keys)
+    for key in keys:
+        tree.insert(key, key)
+
+    random.seed(0)
+    probes = zipf_keys(n, reads, s)
+    latencies = []
+    clock = time.perf_counter_ns
+    for key in probes:
+        start = clock()
+        tree.get(key)
+        latencies.append(clock() - start)
+
+    latencies.sort()
+    line = (f"{name:>12}: mean {sum(latencies) / reads:>6.0f} ns, "
+            f"p50 {latencies[reads // 2]:>6} ns, "
+            f"p99 {latencies[reads * 99 // 100]:>6} ns")
+    if hot_cache:
+        line += f", hit rate {tree.hot_stats()['hit_rate']:.1%}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare AVLTreeMap backends")
+    parser.add_argument("-n", type=int, default=100000)
+    parser.add_argument("--order", type=int, action="append", default=[],
+                        help="B-tree order to measure (repeatable)")
+    parser.add_argument("--zipf", type=float, metavar="S",
+                        help="instead compare get with and without the hot cache on Zipf(S) reads")
+    parser.add_argument("--hot-cache", type=int, default=1024)
+    args = parser.parse_args()
+
+    if args.zipf is not None:
+        reads = 10 * args.n
+        measure_zipf("plain", args.n, reads, args.zipf)
+        measure_zipf(f"hot({args.hot_cache})", args.n, reads, args.zipf, args.hot_cache)
+        return
+
+    measure("avl", args.n)
+    for order in args.order or [16, 64, 256]:
+        measure(f"btree({order})", args.n, backend="btree", order=order)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,417 @@
+from bisect import bisect_left, bisect_right
+
+from sorted_map import SortedMap
+from avl_core import ERASED
+
+class BTreeMap(SortedMap):
+    class Leaf:
+        __slots__ = ("keys", "values", "next")
+
+        def __init__(self, keys=None, values=None, next=None):
+            self.keys = [] if keys is None else keys
+            self.values = [] if values is None else values
+            self.next = next
+
+    class Inner:
+        __slots__ = ("keys", "children")
+
+        def __init__(self, keys=None, children=None):
+            # children[i] holds keys k with keys[i - 1] <= k < keys[i]
+            self.keys = [] if keys is None else keys
+            self.children = [] if children is None else children
+
+    def __init__(self, order=64):
+        if order < 4:
+            raise ValueError("B-tree order must be at least 4")
+        super().__init__()
+        self.order = order
+        self.root = BTreeMap.Leaf()
+
+    def _apply_pending(self, pending):
+        current_keys, current_values = self._sorted_lists()
+
+        keys = []
+        values = []
+        i = 0
+        j = 0
+        while i < len(current_keys) or j < len(pending):
+            if j == len(pending) or (i < len(current_keys) and current_keys[i] < pending[j][0]):
+                keys.append(current_keys[i])
+                values.append(current_values[i])
+                i += 1
+                continue
+
+            if i < len(current_keys) and current_keys[i] == pending[j][0]:
+                i += 1
+            if pending[j][1] is not ERASED:
+                keys.append(pending[j][0])
+                values.append(pending[j][1])
+            j += 1
+
+        tree = self._from_sorted(keys, values)
+        self.root = tree.root
+        self.len = tree.len
+
+    def _find_leaf(self, key):
+        node = self.root
+        while type(node) is BTreeMap.Inner:
+            node = node.children[bisect_right(node.keys, key)]
+        return node
+
+    def _first_leaf(self):
+        node = self.root
+        while type(node) is BTreeMap.Inner:
+            node = node.children[0]
+        return node
+
+    def _last_leaf(self):
+        node = self.root
+        while type(node) is BTreeMap.Inner:
+            node = node.children[-1]
+        return node
+
+    def get(self, key):
+        if self.pending and key in self.pending:
+            value = self.pending[key]
+            if value is ERASED:
+                raise KeyError(f"Key {key} not found")
+            return value
+
+        leaf = self._find_leaf(key)
+        i = bisect_left(leaf.keys, key)
+        if i < len(leaf.keys) and leaf.keys[i] == key:
+            return leaf.values[i]
+        raise KeyError(f"Key {key} not found")
+
+    def _contains_key(self, key):
+        leaf = self._find_leaf(key)
+        i = bisect_left(leaf.keys, key)
+        return i < len(leaf.keys) and leaf.keys[i] == key
+
+    def get_min(self):
+        self._flush()
+        if self.len == 0:
+            raise RuntimeError("Tree is empty")
+        leaf = self._first_leaf()
+        return leaf.keys[0], leaf.values[0]
+
+    def get_max(self):
+        self._flush()
+        if self.len == 0:
+            raise RuntimeError("Tree is empty")
+        leaf = self._last_leaf()
+        return leaf.keys[-1], leaf.values[-1]
+
+    def _search(self, key, below, strict):
+        self._flush()
+        node = self.root
+        prev = None
+        while type(node) is BTreeMap.Inner:
+            i = bisect_right(node.keys, key)
+            if i > 0:
+                prev = node.children[i - 1]
+            node = node.children[i]
+
+        if below:
+            i = bisect_left(node.keys, key) if strict else bisect_right(node.keys, key)
+            if i > 0:
+                return node.keys[i - 1], node.values[i - 1]
+            if prev is None:
+                return None
+            while type(prev) is BTreeMap.Inner:
+                prev = prev.children[-1]
+            return prev.keys[-1], prev.values[-1]
+
+        i = bisect_right(node.keys, key) if strict else bisect_left(node.keys, key)
+        if i < len(node.keys):
+            return node.keys[i], node.values[i]
+        if node.next is None:
+            return None
+        return node.next.keys[0], node.next.values[0]
+
+    @staticmethod
+    def _item_key(item):
+        return item[0]
+
+    def items(self):
+        self._flush()
+        leaf = self._first_leaf()
+        while leaf is not None:
+            yield from zip(leaf.keys, leaf.values)
+            leaf = leaf.next
+
+    def _diff_same(self, other):
+        # walks the two leaf lists side by side
+        self._flush()
+        other._flush()
+
+        left, i = self._first_leaf(), 0
+        right, j = other._first_leaf(), 0
+        while left is not None and right is not None:
+            if i == len(left.keys):
+                left, i = left.next, 0
+            elif j == len(right.keys):
+                right, j = right.next, 0
+            elif left.keys[i] < right.keys[j]:
+                yield "removed", left.keys[i], left.values[i], None
+                i += 1
+            elif right.keys[j] < left.keys[i]:
+                yield "added", right.keys[j], None, right.values[j]
+                j += 1
+            else:
+                if left.values[i] != right.values[j]:
+                    yield "changed", left.keys[i], left.values[i], right.values[j]
+                i += 1
+                j += 1
+
+        while left is not None:
+            for k in range(i, len(left.keys)):
+                yield "removed", left.keys[k], left.values[k], None
+            left, i = left.next, 0
+        while right is not None:
+            for k in range(j, len(right.keys)):
+                yield "added", right.keys[k], None, right.values[k]
+            right, j = right.next, 0
+
+    def _insert(self, node, key, value):
+        # returns (separator, new right sibling) if node had to be split
+        if type(node) is BTreeMap.Leaf:
+            i = bisect_left(node.keys, key)
+            if i < len(node.keys) and node.keys[i] == key:
+                node.values[i] = value
+                return None, False
+
+            node.keys.insert(i, key)
+            node.values.insert(i, value)
+            if len(node.keys) <= self.order:
+                return None, True
+
+            mid = len(node.keys) // 2
+            right = BTreeMap.Leaf(node.keys[mid:], node.values[mid:], node.next)
+            del node.keys[mid:]
+            del node.values[mid:]
+            node.next = right
+            return (right.keys[0], right), True
+
+        i = bisect_right(node.keys, key)
+        split, res = self._insert(node.children[i], key, value)
+        if split is None:
+            return None, res
+
+        separator, right = split
+        node.keys.insert(i, separator)
+        node.children.insert(i + 1, right)
+        if len(node.children) <= self.order:
+            return None, res
+
+        mid = len(node.keys) // 2
+        separator = node.keys[mid]
+        right = BTreeMap.Inner(node.keys[mid + 1:], node.children[mid + 1:])
+        del node.keys[mid:]
+        del node.children[mid + 1:]
+        return (separator, right), res
+
+    def insert(self, key, value):
+        if self._buffer(key, value):
+            return
+        split, res = self._insert(self.root, key, value)
+        if split is not None:
+            separator, right = split
+            self.root = BTreeMap.Inner([separator], [self.root, right])
+        self.len += int(res)
+
+    def _fill(self, node):
+        return len(node.keys) if type(node) is BTreeMap.Leaf else len(node.children)
+
+    def _fix_child(self, parent, i):
+        child = parent.children[i]
+        left = parent.children[i - 1] if i > 0 else None
+        right = parent.children[i + 1] if i + 1 < len(parent.children) else None
+        is_leaf = type(child) is BTreeMap.Leaf
+
+        if left is not None and self._fill(left) > self.order // 2:
+            if is_leaf:
+                child.keys.insert(0, left.keys.pop())
+                child.values.insert(0, left.values.pop())
+                parent.keys[i - 1] = child.keys[0]
+            else:
+                child.keys.insert(0, parent.keys[i - 1])
+                child.children.insert(0, left.children.pop())
+                parent.keys[i - 1] = left.keys.pop()
+            return
+
+        if right is not None and self._fill(right) > self.order // 2:
+            if is_leaf:
+                child.keys.append(right.keys.pop(0))
+                child.values.append(right.values.pop(0))
+                parent.keys[i] = right.keys[0]
+            else:
+                child.keys.append(parent.keys[i])
+                child.children.append(right.children.pop(0))
+                parent.keys[i] = right.keys.pop(0)
+            return
+
+        if left is None:
+            i += 1
+            left, child = child, right
+
+        # merge child into its left sibling
+        if is_leaf:
+            left.keys += child.keys
+            left.values += child.values
+            left.next = child.next
+        else:
+            left.keys.append(parent.keys[i - 1])
+            left.keys += child.keys
+            left.children += child.children
+        del parent.keys[i - 1]
+        del parent.children[i]
+
+    def _erase(self, node, key):
+        if type(node) is BTreeMap.Leaf:
+            i = bisect_left(node.keys, key)
+            if i < len(node.keys) and node.keys[i] == key:
+                del node.keys[i]
+                del node.values[i]
+                return True
+            return False
+
+        i = bisect_right(node.keys, key)
+        res = self._erase(node.children[i], key)
+        if res and self._fill(node.children[i]) < self.order // 2:
+            self._fix_child(node, i)
+        return res
+
+    def erase(self, key):
+        if self._buffer(key, ERASED):
+            return
+        res = self._erase(self.root, key)
+        if type(self.root) is BTreeMap.Inner and len(self.root.children) == 1:
+            self.root = self.root.children[0]
+        self.len -= int(res)
+
+    @staticmethod
+    def _chunk_bounds(n, size):
+        # splits range(n) into the fewest even chunks of at most size elements
+        count = max(1, -(-n // size))
+        step, extra = divmod(n, count)
+        start = 0
+        for i in range(count):
+            end = start + step + (1 if i < extra else 0)
+            yield start, end
+            start = end
+
+    def _from_sorted(self, keys, values):
+        tree = BTreeMap(self.order)
+        tree.len = len(keys)
+        if not keys:
+            return tree
+
+        level = []
+        prev = None
+        for start, end in self._chunk_bounds(len(keys), self.order):
+            leaf = BTreeMap.Leaf(keys[start:end], values[start:end])
+            if prev is not None:
+                prev.next = leaf
+            prev = leaf
+            level.append((leaf.keys[0], leaf))
+
+        while len(level) > 1:
+            parents = []
+            for start, end in self._chunk_bounds(len(level), self.order):
+                chunk = level[start:end]
+                inner = BTreeMap.Inner([k for k, _ in chunk[1:]], [node for _, node in chunk])
+                parents.append((chunk[0][0], inner))
+            level = parents
+
+        tree.root = level[0][1]
+        return tree
+
+    def _sorted_lists(self):
+        keys = []
+        values = []
+        leaf = self._first_leaf()
+        while leaf is not None:
+            keys += leaf.keys
+            values += leaf.values
+            leaf = leaf.next
+        return keys, values
+
+    def __getstate__(self):
+        self._flush()
+        keys, values = self._sorted_lists()
+        return self.order, keys, values
+
+    def __setstate__(self, state):
+        order, keys, values = state
+        self.order = order
+        tree = self._from_sorted(keys, values)
+        self.root = tree.root
+        self.len = tree.len
+        self.pending = None
+
+    def split(self, x):
+        self._flush()
+        keys, values = self._sorted_lists()
+        i = bisect_right(keys, x)
+        return self._from_sorted(keys[:i], values[:i]), self._from_sorted(keys[i:], values[i:])
+
+    def join(self, other):
+        self._flush()
+        other._flush()
+        keys1, values1 = self._sorted_lists()
+        keys2, values2 = other._sorted_lists()
+
+        if not keys1 or not keys2 or keys1[-1] < keys2[0]:
+            keys = keys1 + keys2
+            values = values1 + values2
+        else:
+            keys = []
+            values = []
+            i = 0
+            j = 0
+            while i < len(keys1) and j < len(keys2):
+                if keys1[i] < keys2[j]:
+                    keys.append(keys1[i])
+                    values.append(values1[i])
+                    i += 1
+                else:
+                    keys.append(keys2[j])
+                    values.append(values2[j])
+                    j += 1
+            keys += keys1[i:] + keys2[j:]
+            values += values1[i:] + values2[j:]
+
+        joined = self._from_sorted(keys, values)
+        self.root = joined.root
+        self.len = joined.len
+        other.root = BTreeMap.Leaf()
+        other.len = 0
+
+    def pop_range(self, lo, hi):
+        self._flush()
+        keys, values = self._sorted_lists()
+        i = bisect_left(keys, lo)
+        j = max(i, bisect_left(keys, hi))
+        popped = self._from_sorted(keys[i:j], values[i:j])
+        rest = self._from_sorted(keys[:i] + keys[j:], values[:i] + values[j:])
+        self.root = rest.root
+        self.len = rest.len
+        return popped
+
+    def erase_range(self, lo, hi):
+        self.pop_range(lo, hi)
+
+    def __str__(self):
+        self._flush()
+        def node_to_str(node):
+            name = f"n{id(node)}"
+            if type(node) is BTreeMap.Leaf:
+                return f"{name} [label=\"{' '.join(map(str, node.keys))}\" shape=box]\n"
+            result = f"{name} [label=\"{' '.join(map(str, node.keys))}\"]\n"
+            for child in node.children:
+                result += f"{name} -- n{id(child)}\n"
+                result += node_to_str(child)
+            return result
+
+        return f"strict graph {{\n{node_to_str(self.root)}}}"
@@ -0,0 +1,54 @@
+import heapq
+
+# default for values.get(), which AVLTreeMap.get uses to tell a miss from None
+MISSING = object()
+
+
+class HotCache:
+    # values of the most often read keys; AVLTreeMap.get works on the fields
+    # directly because it is on the hot path. One read in sample_every is
+    # counted; every refresh_every samples the capacity most counted keys
+    # become the hot set and all counts are halved, so keys that stop being
+    # read fall out. A hot key's value is cached on its next read from the tree.
+    def __init__(self, capacity, sample_every=8, refresh_every=None):
+        if capacity < 1:
+            raise ValueError("Capacity must be at least 1")
+        self.capacity = capacity
+        self.sample_every = sample_every
+        self.refresh_every = refresh_every or max(1024, 4 * capacity)
+        self.values = {}
+        self.keys = set()
+        self.counts = {}
+        self.countdown = sample_every
+        self.samples = 0
+        self.reads = 0
+        self.hits = 0
+
+    def sample(self, key):
+        self.countdown = self.sample_every
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.samples += 1
+        if self.samples == self.refresh_every:
+            self.refresh()
+
+    def refresh(self):
+        counts = self.counts
+        self.keys = set(heapq.nlargest(self.capacity, counts, key=counts.get))
+        self.values = {key: value for key, value in self.values.items() if key in self.keys}
+        self.counts = {key: n >> 1 for key, n in counts.items() if n > 1}
+        self.samples = 0
+
+    def discard(self, key):
+        self.values.pop(key, None)
+
+    def clear(self):
+        self.values.clear()
+
+    def stats(self):
+        return {
+            "reads": self.reads,
+            "hits": self.hits,
+            "misses": self.reads - self.hits,
+            "hit_rate": self.hits / self.reads if self.reads else 0.0,
+            "size": len(self.values),
+        }
@@ -0,0 +1,332 @@
+import hashlib
+import heapq
+import math
+import os
+import pickle
+import struct
+import threading
+from bisect import bisect_left, bisect_right
+
+from avl_map import AVLTreeMap, _encoded
+
+# 02: Bloom filters hash the canonical key encoding instead of pickle
+RUN_MAGIC = b"AVLRUN02"
+_TAIL = struct.Struct("<Q8s")
+
+# stored in the memtable and in runs in place of an erased key's value
+TOMBSTONE = object()
+
+
+def _run_seq(path):
+    # run files are named run-<seq>.sst
+    return int(os.path.basename(path)[4:-4])
+
+
+class BloomFilter:
+    def __init__(self, n_bits, n_hashes, bits=None):
+        self.n_bits = n_bits
+        self.n_hashes = n_hashes
+        self.bits = bytearray((n_bits + 7) // 8) if bits is None else bytearray(bits)
+
+    @staticmethod
+    def for_capacity(n, bits_per_key):
+        n_bits = max(64, n * bits_per_key)
+        n_hashes = max(1, round(bits_per_key * math.log(2)))
+        return BloomFilter(n_bits, n_hashes)
+
+    def _positions(self, key):
+        # the canonical encoding treats 1, 1.0 and True as one key, like the
+        # memtable does; other key types fall back to pickle
+        try:
+            data = _encoded(key)
+        except TypeError:
+            data = pickle.dumps(key, protocol=4)
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.n_bits for i in range(self.n_hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class RunWriter:
+    # writes an immutable sorted run: pickled blocks of index_interval entries,
+    # then a footer with the sparse index (first key and offset of every block)
+    # and the Bloom filter. A compacted run also stores covers_from, the lowest
+    # seq it was merged from
+    def __init__(self, path, expected_count, index_interval, bloom_bits_per_key, covers_from=None):
+        self.path = path
+        self.covers_from = covers_from
+        self.tmp_path = path + ".tmp"
+        self.file = open(self.tmp_path, "wb")
+        self.index_interval = index_interval
+        self.bloom = BloomFilter.for_capacity(expected_count, bloom_bits_per_key)
+        self.index_keys = []
+        self.offsets = []
+        self.count = 0
+        self.keys = []
+        self.values = []
+        self.deleted = []
+
+    def add(self, key, value):
+        self.bloom.add(key)
+        self.keys.append(key)
+        if value is TOMBSTONE:
+            self.values.append(None)
+            self.deleted.append(len(self.keys) - 1)
+        else:
+            self.values.append(value)
+        self.count += 1
+        if len(self.keys) == self.index_interval:
+            self._write_block()
+
+    def _write_block(self):
+        if not self.keys:
+            return
+        self.index_keys.append(self.keys[0])
+        self.offsets.append(self.file.tell())
+        pickle.dump((self.keys, self.values, self.deleted), self.file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.keys = []
+        self.values = []
+        self.deleted = []
+
+    def finish(self):
+        self._write_block()
+        footer_offset = self.file.tell()
+        self.offsets.append(footer_offset)
+        footer = {
+            "count": self.count,
+            "index_keys": self.index_keys,
+            "offsets": self.offsets,
+            "bloom_bits": bytes(self.bloom.bits),
+            "bloom_size": self.bloom.n_bits,
+            "bloom_hashes": self.bloom.n_hashes,
+            "covers_from": self.covers_from,
+        }
+        pickle.dump(footer, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.file.write(_TAIL.pack(footer_offset, RUN_MAGIC))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+        return Run(self.path)
+
+
+class Run:
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        size = os.fstat(self.fd).st_size
+        footer_offset, magic = _TAIL.unpack(os.pread(self.fd, _TAIL.size, size - _TAIL.size))
+        if magic != RUN_MAGIC:
+            os.close(self.fd)
+            raise ValueError(f"{path} is not a run file")
+
+        footer = pickle.loads(os.pread(self.fd, size - _TAIL.size - footer_offset, footer_offset))
+        self.count = footer["count"]
+        self.index_keys = footer["index_keys"]
+        self.offsets = footer["offsets"]
+        self.bloom = BloomFilter(footer["bloom_size"], footer["bloom_hashes"], footer["bloom_bits"])
+        self.covers_from = footer["covers_from"]
+
+    def __del__(self):
+        # readers may still hold a compacted run, so the fd lives as long as the object
+        if getattr(self, "fd", None) is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _read_block(self, i):
+        start = self.offsets[i]
+        return pickle.loads(os.pread(self.fd, self.offsets[i + 1] - start, start))
+
+    def get(self, key):
+        # returns (value,), TOMBSTONE, or None if the key is not in this run
+        if key not in self.bloom:
+            return None
+        block = bisect_right(self.index_keys, key) - 1
+        if block < 0:
+            return None
+
+        keys, values, deleted = self._read_block(block)
+        i = bisect_left(keys, key)
+        if i == len(keys) or keys[i] != key:
+            return None
+        if deleted and i in deleted:
+            return TOMBSTONE
+        return (values[i],)
+
+    def entries(self):
+        for block in range(len(self.index_keys)):
+            keys, values, deleted = self._read_block(block)
+            deleted = set(deleted)
+            for i, key in enumerate(keys):
+                yield key, TOMBSTONE if i in deleted else values[i]
+
+
+class LSMStore:
+    def __init__(self, directory, memtable_limit=10000, index_interval=64,
+                 bloom_bits_per_key=10, compaction_threshold=4):
+        self.directory = directory
+        self.memtable_limit = memtable_limit
+        self.index_interval = index_interval
+        self.bloom_bits_per_key = bloom_bits_per_key
+        self.compaction_threshold = compaction_threshold
+
+        os.makedirs(directory, exist_ok=True)
+        names = sorted(
+            (name for name in os.listdir(directory) if name.startswith("run-") and name.endswith(".sst")),
+            reverse=True
+        )
+        # newest run first. A crash in the middle of compact() can leave runs
+        # that were already merged into a newer one; they would bring back keys
+        # the merge dropped tombstones for, so they are deleted here
+        self.runs = []
+        covered = None
+        for name in names:
+            run = Run(os.path.join(directory, name))
+            if covered is not None and _run_seq(run.path) >= covered:
+                os.remove(run.path)
+                continue
+            self.runs.append(run)
+            if run.covers_from is not None:
+                covered = run.covers_from if covered is None else min(covered, run.covers_from)
+        self.next_seq = _run_seq(names[0]) + 1 if names else 0
+
+        self.memtable = AVLTreeMap()
+        self.lock = threading.Lock()
+        # held for a whole compaction, so an explicit compact() waits for the
+        # background one instead of merging the same runs into the same file
+        self.compaction_lock = threading.Lock()
+        self.compaction = None
+        self.compaction_error = None
+
+    def _run_path(self):
+        with self.lock:
+            seq = self.next_seq
+            self.next_seq += 1
+        return os.path.join(self.directory, f"run-{seq:08d}.sst")
+
+    def insert(self, key, value):
+        self.memtable.insert(key, value)
+        if len(self.memtable) >= self.memtable_limit:
+            self.flush()
+
+    def erase(self, key):
+        self.insert(key, TOMBSTONE)
+
+    def get(self, key):
+        try:
+            value = self.memtable.get(key)
+        except KeyError:
+            pass
+        else:
+            if value is TOMBSTONE:
+                raise KeyError(f"Key {key} not found")
+            return value
+
+        with self.lock:
+            runs = list(self.runs)
+        for run in runs:
+            found = run.get(key)
+            if found is TOMBSTONE:
+                break
+            if found is not None:
+                return found[0]
+        raise KeyError(f"Key {key} not found")
+
+    def __contains__(self, key):
+        try:
+            self.get(key)
+            return True
+        except KeyError:
+            return False
+
+    def items(self):
+        with self.lock:
+            runs = list(self.runs)
+        sources = [self.memtable.items()] + [run.entries() for run in runs]
+        yield from self._merge(sources, drop_tombstones=True)
+
+    @staticmethod
+    def _merge(sources, drop_tombstones):
+        # sources go from newest to oldest; the newest entry for a key wins
+        tagged = [((key, age, value) for key, value in source) for age, source in enumerate(sources)]
+        first = True
+        last = None
+        for key, _, value in heapq.merge(*tagged, key=lambda entry: (entry[0], entry[1])):
+            if not first and key == last:
+                continue
+            first = False
+            last = key
+            if value is TOMBSTONE and drop_tombstones:
+                continue
+            yield key, value
+
+    def flush(self):
+        if len(self.memtable) == 0:
+            return
+
+        writer = RunWriter(self._run_path(), len(self.memtable), self.index_interval, self.bloom_bits_per_key)
+        AVLTreeMap.Node.in_order(self.memtable.root, lambda node: writer.add(node.key, node.value))
+        run = writer.finish()
+
+        with self.lock:
+            self.runs.insert(0, run)
+            should_compact = len(self.runs) >= self.compaction_threshold
+        self.memtable = AVLTreeMap()
+
+        if should_compact and (self.compaction is None or not self.compaction.is_alive()):
+            self.compaction = threading.Thread(target=self._compact_in_background, daemon=True)
+            self.compaction.start()
+
+    def _compact_in_background(self):
+        # the error is re-raised by wait_for_compaction()
+        try:
+            self.compact()
+        except Exception as e:
+            self.compaction_error = e
+
+    def compact(self):
+        with self.compaction_lock:
+            self._compact()
+
+    def _compact(self):
+        # merges every run present right now into one; runs flushed meanwhile are
+        # newer and stay in front of the result
+        with self.lock:
+            old_runs = list(self.runs)
+        if len(old_runs) < 2:
+            return
+
+        # the result replaces the newest compacted file, so on reopen it still
+        # sorts behind runs flushed during compaction. It records the seqs it
+        # covers, so the older files are dropped on reopen even if a crash
+        # leaves them behind
+        writer = RunWriter(old_runs[0].path, sum(run.count for run in old_runs),
+                           self.index_interval, self.bloom_bits_per_key,
+                           covers_from=min(_run_seq(run.path) for run in old_runs))
+        # the oldest run takes part, so tombstones have nothing left to hide
+        for key, value in self._merge([run.entries() for run in old_runs], drop_tombstones=True):
+            writer.add(key, value)
+        merged = writer.finish()
+
+        with self.lock:
+            self.runs = [run for run in self.runs if run not in old_runs] + [merged]
+        for run in old_runs[1:]:
+            os.remove(run.path)
+
+    def wait_for_compaction(self):
+        if self.compaction is not None:
+            self.compaction.join()
+        if self.compaction_error is not None:
+            error, self.compaction_error = self.compaction_error, None
+            raise error
+
+    def close(self):
+        self.flush()
+        self.wait_for_compaction()
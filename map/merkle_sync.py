@@ -0,0 +1,53 @@
+def describe_range(tree, lo, hi):
+    # (hash, count, median key) of the items with lo <= key < hi
+    range_hash, count = tree.range_hash(lo, hi)
+    median = None
+    if count >= 2:
+        start = 0 if lo is None else tree.rank(lo)
+        median = tree.key_at(start + count // 2)
+    return range_hash, count, median
+
+
+def _range_order(key_range):
+    lo, _ = key_range
+    return (lo is not None, lo)
+
+
+def find_divergent_ranges(tree, conn, leader):
+    # Both replicas call this on the two ends of a multiprocessing Pipe, one of
+    # them with leader=True. Every round the leader sends all still unresolved
+    # (lo, hi) ranges at once and splits the mismatching ones at a median key,
+    # so d differences take O(log n) rounds and O(d log n) range hashes.
+    # Both sides return the sorted list of ranges whose contents differ; each
+    # of them holds at most one key on either side.
+    if not leader:
+        while True:
+            ranges = conn.recv()
+            if ranges is None:
+                return conn.recv()
+            conn.send([describe_range(tree, lo, hi) for lo, hi in ranges])
+
+    ranges = [(None, None)]
+    divergent = []
+    while ranges:
+        conn.send(ranges)
+        theirs = conn.recv()
+
+        next_ranges = []
+        for (lo, hi), (their_hash, their_count, their_median) in zip(ranges, theirs):
+            my_hash, my_count, my_median = describe_range(tree, lo, hi)
+            if my_hash == their_hash and my_count == their_count:
+                continue
+            if my_count < 2 and their_count < 2:
+                divergent.append((lo, hi))
+                continue
+
+            mid = my_median if my_count >= their_count else their_median
+            next_ranges.append((lo, mid))
+            next_ranges.append((mid, hi))
+        ranges = next_ranges
+
+    divergent.sort(key=_range_order)
+    conn.send(None)
+    conn.send(divergent)
+    return divergent
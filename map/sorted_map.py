@@ -0,0 +1,73 @@
+import os
+import sys
+from abc import abstractmethod
+
+# the shared tree core lives in ../avl, which is not a package. Importing this
+# module (and so avl_map or btree_map) therefore appends that folder to
+# sys.path. It is appended, not prepended, so modules next to the caller
+# (e.g. map/benchmark.py) still win over same-named ones in ../avl
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "avl"))
+
+from avl_core import BufferedTree
+
+
+def diff_items(left, right):
+    # diff() of two sorted (key, value) iterables; used when the two maps have
+    # different backends and share no structure
+    left = iter(left)
+    right = iter(right)
+    a = next(left, None)
+    b = next(right, None)
+    while a is not None and b is not None:
+        if a[0] < b[0]:
+            yield "removed", a[0], a[1], None
+            a = next(left, None)
+        elif b[0] < a[0]:
+            yield "added", b[0], None, b[1]
+            b = next(right, None)
+        else:
+            if a[1] != b[1]:
+                yield "changed", a[0], a[1], b[1]
+            a = next(left, None)
+            b = next(right, None)
+
+    while a is not None:
+        yield "removed", a[0], a[1], None
+        a = next(left, None)
+    while b is not None:
+        yield "added", b[0], None, b[1]
+        b = next(right, None)
+
+
+class SortedMap(BufferedTree):
+    # Common base of AVLTreeMap and BTreeMap, so maps of either backend can be
+    # diffed and compared with each other.
+
+    @abstractmethod
+    def get(self, key):
+        pass
+
+    @abstractmethod
+    def items(self):
+        pass
+
+    @abstractmethod
+    def _diff_same(self, other):
+        # diff() against a map of the same type, which may use its structure
+        pass
+
+    def diff(self, other):
+        # yields (kind, key, old_value, new_value) describing how other differs
+        # from self
+        if not isinstance(other, SortedMap):
+            raise TypeError("Can only diff with another map")
+        if type(other) is type(self):
+            return self._diff_same(other)
+        return diff_items(self.items(), other.items())
+
+    def __eq__(self, other):
+        if not isinstance(other, SortedMap):
+            return NotImplemented
+        if len(self) != len(other):
+            return False
+        return next(self.diff(other), None) is None
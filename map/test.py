@@ -1,7 +1,16 @@
+import copy
+import multiprocessing
 import os
+import pickle
 import random
+import subprocess
+import sys
 import pytest
 from avl_map import AVLTreeMap
+from btree_map import BTreeMap
+from sorted_map import SortedMap
+from merkle_sync import find_divergent_ranges
+from lsm_store import BloomFilter, LSMStore
 
 N_ELEMENTS = 30
 
@@ -153,8 +162,659 @@ def test_split():
     split_key = N_ELEMENTS // 3
     avl1, avl2 = avl.split(split_key)
 
+    is_avl(avl1.root)
+    is_avl(avl2.root)
+    check_elements(avl1, {i: f"value_{i}" for i in range(split_key + 1)})
+    check_elements(avl2, {i: f"value_{i}" for i in range(split_key + 1, N_ELEMENTS)})
+    assert len(avl1) == split_key + 1
+    assert len(avl2) == N_ELEMENTS - split_key - 1
+
     draw_tree(avl1, "draw/split1")
     draw_tree(avl2, "draw/split2")
 
+def test_erase_range(avl_map_and_dict):
+    avl, ref_dict = avl_map_and_dict
+    lo, hi = N_ELEMENTS // 4, N_ELEMENTS // 2
+    avl.erase_range(lo, hi)
+    for key in range(lo, hi):
+        ref_dict.pop(key)
+
+    is_avl(avl.root)
+    check_elements(avl, ref_dict)
+    assert len(avl) == len(ref_dict)
+    draw_tree(avl, "draw/erase-range")
+
+def test_pop_range():
+    avl = AVLTreeMap()
+    ref_dict = {}
+    for _ in range(1000):
+        key = random.randint(0, 10 * N_ELEMENTS)
+        avl.insert(key, f"value_{key}")
+        ref_dict[key] = f"value_{key}"
+
+    for _ in range(N_ELEMENTS):
+        lo = random.randint(0, 10 * N_ELEMENTS)
+        hi = lo + random.randint(0, 3 * N_ELEMENTS)
+        popped = avl.pop_range(lo, hi)
+        removed = {key: value for key, value in ref_dict.items() if lo <= key < hi}
+        for key in removed:
+            ref_dict.pop(key)
+
+        is_avl(popped.root)
+        is_avl(avl.root)
+        check_elements(avl, ref_dict)
+        check_elements(popped, removed)
+        assert len(avl) == len(ref_dict)
+        assert len(popped) == len(removed)
+
+def is_btree(tree: BTreeMap) -> None:
+    leaves = []
+
+    def check(node, lo, hi, depth):
+        assert node.keys == sorted(node.keys)
+        assert all((lo is None or lo <= k) and (hi is None or k < hi) for k in node.keys)
+
+        if type(node) is BTreeMap.Leaf:
+            assert len(node.keys) == len(node.values)
+            assert node is tree.root or len(node.keys) >= tree.order // 2
+            assert len(node.keys) <= tree.order
+            leaves.append(node)
+            return depth
+
+        assert len(node.children) == len(node.keys) + 1
+        assert node is tree.root or len(node.children) >= tree.order // 2
+        assert len(node.children) <= tree.order
+        bounds = [lo] + node.keys + [hi]
+        depths = {check(child, bounds[i], bounds[i + 1], depth + 1) for i, child in enumerate(node.children)}
+        assert len(depths) == 1, "Leaves are not on the same level"
+        return depths.pop()
+
+    check(tree.root, None, None, 0)
+    for leaf, next_leaf in zip(leaves, leaves[1:] + [None]):
+        assert leaf.next is next_leaf
+
+def test_btree_backend():
+    tree = AVLTreeMap(backend="btree", order=4)
+    assert isinstance(tree, BTreeMap)
+    assert isinstance(tree, SortedMap)
+    assert isinstance(AVLTreeMap(), SortedMap)
+    assert tree.order == 4
+    with pytest.raises(ValueError):
+        AVLTreeMap(backend="splay")
+
+def test_btree_random():
+    tree = AVLTreeMap(backend="btree", order=4)
+    ref_dict = {}
+    for _ in range(3000):
+        key = random.randint(0, 10 * N_ELEMENTS)
+        if random.random() < 0.6:
+            tree.insert(key, f"value_{key}")
+            ref_dict[key] = f"value_{key}"
+        else:
+            tree.erase(key)
+            ref_dict.pop(key, None)
+
+        assert len(tree) == len(ref_dict)
+        assert (key in tree) == (key in ref_dict)
+    
+    is_btree(tree)
+    assert list(tree.items()) == sorted(ref_dict.items())
+    for key, value in ref_dict.items():
+        assert tree.get(key) == value
+    assert tree.get_min() == min(ref_dict.items())
+    assert tree.get_max() == max(ref_dict.items())
+
+    for key in list(ref_dict):
+        tree.erase(key)
+    is_btree(tree)
+    assert len(tree) == 0
+    with pytest.raises(KeyError):
+        tree.get(0)
+    with pytest.raises(RuntimeError):
+        tree.get_min()
+
+def test_btree_split_join():
+    tree = AVLTreeMap(backend="btree", order=4)
+    for i in range(10 * N_ELEMENTS):
+        tree.insert(i, f"value_{i}")
+
+    t1, t2 = tree.split(N_ELEMENTS)
+    is_btree(t1)
+    is_btree(t2)
+    assert list(t1.items()) == [(i, f"value_{i}") for i in range(N_ELEMENTS + 1)]
+    assert len(t2) == 9 * N_ELEMENTS - 1
+
+    popped = t2.pop_range(2 * N_ELEMENTS, 3 * N_ELEMENTS)
+    is_btree(t2)
+    is_btree(popped)
+    assert [k for k, _ in popped.items()] == list(range(2 * N_ELEMENTS, 3 * N_ELEMENTS))
+
+    t1.join(popped)
+    is_btree(t1)
+    assert len(t1) == 2 * N_ELEMENTS + 1
+    assert len(popped) == 0
+
+    t2.join(t1)
+    is_btree(t2)
+    assert [k for k, _ in t2.items()] == list(range(10 * N_ELEMENTS))
+
+def test_pickle(avl_map_and_dict):
+    avl, ref_dict = avl_map_and_dict
+    restored = pickle.loads(pickle.dumps(avl))
+    is_avl(restored.root)
+    check_elements(restored, ref_dict)
+    assert len(restored) == len(ref_dict)
+
+    big = AVLTreeMap()
+    for i in range(20000):
+        big.insert(i, i)
+    assert pickle.loads(pickle.dumps(big)).to_lists() == big.to_lists()
+
+    tree = AVLTreeMap(backend="btree", order=4)
+    for key, value in ref_dict.items():
+        tree.insert(key, value)
+    restored = pickle.loads(pickle.dumps(tree))
+    is_btree(restored)
+    assert restored.order == 4
+    assert list(restored.items()) == sorted(ref_dict.items())
+
+def _shared_items(handle):
+    return AVLTreeMap.from_shared_memory(handle).to_lists()
+
+@pytest.mark.parametrize("make_value", [float, hex])
+def test_shared_memory(make_value):
+    avl = AVLTreeMap()
+    ref_dict = {}
+    for _ in range(1000):
+        key = random.randint(-N_ELEMENTS ** 3, N_ELEMENTS ** 3)
+        avl.insert(key, make_value(key))
+        ref_dict[key] = make_value(key)
+
+    shm, handle = avl.to_shared_memory()
+    try:
+        restored = AVLTreeMap.from_shared_memory(handle)
+        is_avl(restored.root)
+        check_elements(restored, ref_dict)
+        assert len(restored) == len(ref_dict)
+
+        with multiprocessing.Pool(1) as pool:
+            keys, values = pool.apply(_shared_items, (handle,))
+        assert list(zip(keys, values)) == sorted(ref_dict.items())
+    finally:
+        shm.close()
+        shm.unlink()
+
+def test_shared_memory_bad_type():
+    avl = AVLTreeMap()
+    avl.insert("a", 1)
+    with pytest.raises(TypeError):
+        avl.to_shared_memory()
+
+    avl = AVLTreeMap()
+    avl.insert(2 ** 70, 1)
+    with pytest.raises(TypeError):
+        avl.to_shared_memory()
+
+def test_shared_memory_big_values():
+    avl = AVLTreeMap()
+    avl.insert(1, 2 ** 70)
+    avl.insert(2, -2 ** 63)
+    shm, handle = avl.to_shared_memory()
+    try:
+        assert AVLTreeMap.from_shared_memory(handle).to_lists() == ([1, 2], [2 ** 70, -2 ** 63])
+    finally:
+        shm.close()
+        shm.unlink()
+
+def reference_search(ref_dict, key):
+    below = [k for k in ref_dict if k <= key]
+    strictly_below = [k for k in ref_dict if k < key]
+    above = [k for k in ref_dict if k >= key]
+    strictly_above = [k for k in ref_dict if k > key]
+
+    floor = max(below, default=None)
+    ceiling = min(above, default=None)
+    if floor is None or ceiling is None:
+        nearest = ceiling if floor is None else floor
+    else:
+        nearest = floor if key - floor <= ceiling - key else ceiling
+
+    result = {
+        "floor": floor,
+        "lower": max(strictly_below, default=None),
+        "ceiling": ceiling,
+        "higher": min(strictly_above, default=None),
+        "nearest": nearest,
+    }
+    return {query: None if k is None else (k, ref_dict[k]) for query, k in result.items()}
+
+@pytest.mark.parametrize("options", [{}, {"backend": "btree", "order": 4}])
+def test_search(options):
+    avl = AVLTreeMap(**options)
+    ref_dict = {}
+    for _ in range(3 * N_ELEMENTS):
+        key = random.randint(0, 10 * N_ELEMENTS) * 2
+        avl.insert(key, f"value_{key}")
+        ref_dict[key] = f"value_{key}"
+
+    probes = list(range(-3, 20 * N_ELEMENTS + 3))
+    expected = [reference_search(ref_dict, key) for key in probes]
+    for query in ("floor", "lower", "ceiling", "higher", "nearest"):
+        assert [getattr(avl, query)(key) for key in probes] == [e[query] for e in expected]
+        assert getattr(avl, f"{query}_many")(probes) == [e[query] for e in expected]
+
+    empty = AVLTreeMap(**options)
+    assert empty.floor(1) is None
+    assert empty.nearest_many([1, 2]) == [None, None]
+    with pytest.raises(ValueError):
+        avl.floor_many([2, 1])
+
+@pytest.mark.parametrize("options", [{}, {"backend": "btree", "order": 4}])
+def test_nearest_needs_numbers(options):
+    avl = AVLTreeMap(**options)
+    avl.insert("b", 1)
+    avl.insert("d", 2)
+    assert avl.floor("c") == ("b", 1)
+    with pytest.raises(TypeError, match="subtraction"):
+        avl.nearest("c")
+    with pytest.raises(TypeError, match="subtraction"):
+        avl.nearest_many(["a", "e"])
+
+@pytest.mark.parametrize("options", [{}, {"backend": "btree", "order": 4}])
+def test_bulk_loading(options):
+    avl = AVLTreeMap(**options)
+    ref_dict = {}
+    for i in range(N_ELEMENTS):
+        avl.insert(i, hex(i))
+        ref_dict[i] = hex(i)
+
+    with avl.bulk_loading():
+        for i in range(1000):
+            key = random.randint(0, 10 * N_ELEMENTS)
+            if random.random() < 0.7:
+                avl.insert(key, i)
+                ref_dict[key] = i
+            else:
+                avl.erase(key)
+                ref_dict.pop(key, None)
+
+            assert (key in avl) == (key in ref_dict)
+            if key in ref_dict:
+                assert avl.get(key) == ref_dict[key]
+            else:
+                with pytest.raises(KeyError):
+                    avl.get(key)
+            assert len(avl) == len(ref_dict)
+
+        assert avl.get_min() == min(ref_dict.items())
+        avl.insert(-1, "last")
+        ref_dict[-1] = "last"
+        assert len(avl) == len(ref_dict)
+
+    assert avl.pending is None
+    if isinstance(avl, BTreeMap):
+        is_btree(avl)
+        assert list(avl.items()) == sorted(ref_dict.items())
+    else:
+        is_avl(avl.root)
+        check_elements(avl, ref_dict)
+    assert len(avl) == len(ref_dict)
+
+def reference_diff(old, new):
+    result = []
+    for key in sorted(old.keys() | new.keys()):
+        if key not in new:
+            result.append(("removed", key, old[key], None))
+        elif key not in old:
+            result.append(("added", key, None, new[key]))
+        elif old[key] != new[key]:
+            result.append(("changed", key, old[key], new[key]))
+    return result
+
+@pytest.mark.parametrize("options", [{}, {"backend": "btree", "order": 4}])
+def test_diff(options):
+    old = {}
+    for _ in range(10 * N_ELEMENTS):
+        key = random.randint(0, 20 * N_ELEMENTS)
+        old[key] = f"value_{key}"
+
+    new = dict(old)
+    for _ in range(N_ELEMENTS):
+        key = random.randint(0, 20 * N_ELEMENTS)
+        if random.random() < 0.5:
+            new[key] = f"new_{key}"
+        else:
+            new.pop(key, None)
+
+    a = AVLTreeMap(**options)
+    b = AVLTreeMap(**options)
+    for key, value in old.items():
+        a.insert(key, value)
+    for key, value in new.items():
+        b.insert(key, value)
+
+    assert list(a.diff(b)) == reference_diff(old, new)
+    assert list(b.diff(a)) == reference_diff(new, old)
+    assert list(a.diff(AVLTreeMap(**options))) == reference_diff(old, {})
+    assert (a == b) == (old == new)
+    assert a != b or old == new
+
+    c = AVLTreeMap(**options)
+    for key in reversed(sorted(old)):
+        c.insert(key, old[key])
+    assert a == c
+    assert list(a.diff(c)) == []
+
+def test_diff_mixed_backends():
+    old = {key: f"value_{key}" for key in random.sample(range(20 * N_ELEMENTS), 10 * N_ELEMENTS)}
+    new = dict(old)
+    for key in random.sample(range(20 * N_ELEMENTS), N_ELEMENTS):
+        if random.random() < 0.5:
+            new[key] = f"new_{key}"
+        else:
+            new.pop(key, None)
+
+    a = AVLTreeMap()
+    b = AVLTreeMap(backend="btree", order=4)
+    for key, value in old.items():
+        a.insert(key, value)
+    for key, value in new.items():
+        b.insert(key, value)
+
+    assert list(a.diff(b)) == reference_diff(old, new)
+    assert list(b.diff(a)) == reference_diff(new, old)
+    assert (a == b) == (old == new)
+    assert (b == a) == (old == new)
+
+    c = AVLTreeMap(backend="btree", order=4)
+    for key, value in old.items():
+        c.insert(key, value)
+    assert a == c
+    assert c == a
+    assert a != AVLTreeMap(backend="btree")
+    with pytest.raises(TypeError):
+        list(a.diff({}))
+
+def test_root_hash(avl_map_and_dict):
+    avl, ref_dict = avl_map_and_dict
+    reversed_avl = AVLTreeMap()
+    for key in reversed(list(ref_dict)):
+        reversed_avl.insert(key, ref_dict[key])
+    assert avl.root_hash() == reversed_avl.root_hash()
+
+    before = avl.root_hash()
+    avl.insert(0, "changed")
+    assert avl.root_hash() != before
+    avl.insert(0, ref_dict[0])
+    assert avl.root_hash() == before
+
+    avl.erase(N_ELEMENTS // 2)
+    assert avl.root_hash() != before
+    avl.insert(N_ELEMENTS // 2, ref_dict[N_ELEMENTS // 2])
+    assert avl.root_hash() == before
+
+    left, right = avl.split(N_ELEMENTS // 3)
+    assert (left.root_hash() + right.root_hash()) % 2 ** 128 == before
+    assert left.range_hash() == (left.root_hash(), len(left))
+    left.join(right)
+    assert left.root_hash() == before
+    assert AVLTreeMap().root_hash() == 0
+
+HASH_SCRIPT = """
+from avl_map import AVLTreeMap
+avl = AVLTreeMap()
+avl.insert(1, frozenset({"alpha", "beta", "gamma", "delta"}))
+avl.insert(2, {"x": 1, "y": [1.5, None], "z": {b"raw", 3}})
+avl.insert(3, ("tuple", -0.0, float("inf")))
+print(avl.root_hash())
+"""
+
+def test_root_hash_across_processes():
+    hashes = set()
+    for seed in ("1", "2", "3"):
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        out = subprocess.run([sys.executable, "-c", HASH_SCRIPT], env=env, check=True,
+                             capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        hashes.add(out.stdout)
+    assert len(hashes) == 1
+
+def test_root_hash_equal_values():
+    a = AVLTreeMap()
+    b = AVLTreeMap()
+    a.insert(1, {"x": 1, "y": 2})
+    b.insert(1.0, {"y": 2.0, "x": True})
+    assert a.root_hash() == b.root_hash()
+
+    b.insert(1.0, {"y": "2", "x": True})
+    assert a.root_hash() != b.root_hash()
+
+    c = AVLTreeMap()
+    c.insert(1, object())
+    with pytest.raises(TypeError):
+        c.root_hash()
+
+def test_range_hash(avl_map_and_dict):
+    avl, ref_dict = avl_map_and_dict
+    for lo in range(-1, N_ELEMENTS + 2, 3):
+        for hi in range(lo, N_ELEMENTS + 2, 4):
+            part = AVLTreeMap()
+            for key in range(max(lo, 0), min(hi, N_ELEMENTS)):
+                part.insert(key, ref_dict[key])
+            assert avl.range_hash(lo, hi) == (part.root_hash(), len(part))
+
+    assert [avl.key_at(i) for i in range(N_ELEMENTS)] == sorted(ref_dict)
+    assert avl.rank(N_ELEMENTS // 2) == N_ELEMENTS // 2
+    with pytest.raises(IndexError):
+        avl.key_at(N_ELEMENTS)
+
+def _follow_sync(conn, tree):
+    conn.send(("follower", find_divergent_ranges(tree, conn, leader=False)))
+
+def test_merkle_sync():
+    a = AVLTreeMap()
+    b = AVLTreeMap()
+    for i in range(10 * N_ELEMENTS):
+        a.insert(i, f"value_{i}")
+        b.insert(i, f"value_{i}")
+
+    changed = random.sample(range(10 * N_ELEMENTS), 5)
+    b.insert(changed[0], "changed")
+    b.erase(changed[1])
+    a.erase(changed[2])
+    a.insert(10 * N_ELEMENTS + 5, "only in a")
+    b.insert(-5, "only in b")
+    expected = {changed[0], changed[1], changed[2], 10 * N_ELEMENTS + 5, -5}
+
+    leader_conn, follower_conn = multiprocessing.Pipe()
+    follower = multiprocessing.Process(target=_follow_sync, args=(follower_conn, b))
+    follower.start()
+    ranges = find_divergent_ranges(a, leader_conn, leader=True)
+    assert leader_conn.recv() == ("follower", ranges)
+    follower.join()
+    assert follower.exitcode == 0
+
+    def contains(key_range, key):
+        lo, hi = key_range
+        return (lo is None or lo <= key) and (hi is None or key < hi)
+
+    assert len(ranges) <= len(expected)
+    for key in expected:
+        assert any(contains(key_range, key) for key_range in ranges)
+    for key_range in ranges:
+        assert any(contains(key_range, key) for key in expected)
+
+def test_merkle_sync_equal(avl_map_and_dict):
+    avl, _ = avl_map_and_dict
+    leader_conn, follower_conn = multiprocessing.Pipe()
+    follower = multiprocessing.Process(target=_follow_sync, args=(follower_conn, avl))
+    follower.start()
+    assert find_divergent_ranges(avl, leader_conn, leader=True) == []
+    assert leader_conn.recv() == ("follower", [])
+    follower.join()
+
+def test_bloom_filter():
+    bloom = BloomFilter.for_capacity(1000, 10)
+    for key in range(1000):
+        bloom.add(key)
+
+    assert all(key in bloom for key in range(1000))
+    false_positives = sum(key in bloom for key in range(1000, 11000))
+    assert false_positives < 300
+
+def test_lsm_store(tmp_path):
+    store = LSMStore(str(tmp_path), memtable_limit=N_ELEMENTS, index_interval=4, compaction_threshold=3)
+    ref_dict = {}
+    for i in range(2000):
+        key = random.randint(0, 10 * N_ELEMENTS)
+        if random.random() < 0.7:
+            store.insert(key, i)
+            ref_dict[key] = i
+        else:
+            store.erase(key)
+            ref_dict.pop(key, None)
+
+    for key in range(-1, 10 * N_ELEMENTS + 2):
+        assert (key in store) == (key in ref_dict)
+        if key in ref_dict:
+            assert store.get(key) == ref_dict[key]
+        else:
+            with pytest.raises(KeyError):
+                store.get(key)
+    assert list(store.items()) == sorted(ref_dict.items())
+
+    store.close()
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+    reopened = LSMStore(str(tmp_path), memtable_limit=N_ELEMENTS, index_interval=4)
+    assert list(reopened.items()) == sorted(ref_dict.items())
+    reopened.compact()
+    assert len(reopened.runs) == 1
+    assert len(os.listdir(tmp_path)) == 1
+    assert list(reopened.items()) == sorted(ref_dict.items())
+    for key, value in ref_dict.items():
+        assert reopened.get(key) == value
+
+def test_lsm_equal_keys(tmp_path):
+    store = LSMStore(str(tmp_path), memtable_limit=N_ELEMENTS)
+    store.insert(1, "a")
+    store.insert(2.0, "b")
+    assert store.get(1.0) == "a"
+    store.flush()
+    assert store.get(1.0) == "a"
+    assert store.get(True) == "a"
+    assert store.get(2) == "b"
+    assert list(store.items()) == [(1, "a"), (2.0, "b")]
+
+def test_lsm_crash_during_compaction(tmp_path):
+    store = LSMStore(str(tmp_path), memtable_limit=N_ELEMENTS, compaction_threshold=100)
+    store.insert(5, "x")
+    store.insert(6, "y")
+    store.flush()
+    store.erase(5)
+    store.flush()
+    oldest = sorted(os.listdir(tmp_path))[0]
+    with open(tmp_path / oldest, "rb") as f:
+        data = f.read()
+    store.compact()
+    store.close()
+
+    # a crash after the merged run was written but before the old one was removed
+    with open(tmp_path / oldest, "wb") as f:
+        f.write(data)
+    reopened = LSMStore(str(tmp_path), memtable_limit=N_ELEMENTS)
+    assert list(reopened.items()) == [(6, "y")]
+    assert 5 not in reopened
+    assert len(reopened.runs) == 1
+    assert not os.path.exists(tmp_path / oldest)
+
+def test_hot_cache():
+    avl = AVLTreeMap(hot_cache=8)
+    for i in range(1000):
+        avl.insert(i, hex(i))
+
+    for _ in range(50000):
+        key = random.randrange(8) if random.random() < 0.9 else random.randrange(1000)
+        assert avl.get(key) == hex(key)
+
+    stats = avl.hot_stats()
+    assert stats["reads"] == 50000
+    assert stats["hit_rate"] > 0.5
+    assert stats["size"] <= 8
+
+    avl.insert(3, "new")
+    assert avl.get(3) == "new"
+    avl.erase(5)
+    with pytest.raises(KeyError):
+        avl.get(5)
+    avl.erase_range(0, 2)
+    with pytest.raises(KeyError):
+        avl.get(1)
+    with avl.bulk_loading():
+        avl.insert(4, "bulk")
+    assert avl.get(4) == "bulk"
+    assert avl.erase_min() == (2, hex(2))
+    with pytest.raises(KeyError):
+        avl.get(2)
+
+def test_hot_cache_kept():
+    avl = AVLTreeMap(hot_cache=8)
+    for i in range(N_ELEMENTS):
+        avl.insert(i, hex(i))
+
+    for other in (pickle.loads(pickle.dumps(avl)), copy.copy(avl), copy.deepcopy(avl),
+                  *avl.split(N_ELEMENTS // 2)):
+        assert other.hot_stats()["reads"] == 0
+        assert other.hot.capacity == 8
+    assert pickle.loads(pickle.dumps(AVLTreeMap())).hot is None
+
+    with pytest.raises(ValueError):
+        AVLTreeMap(backend="btree", hot_cache=8)
+    assert type(AVLTreeMap(backend="btree", hot_cache=0)) is BTreeMap
+
+def test_hot_cache_random():
+    avl = AVLTreeMap(hot_cache=4)
+    ref_dict = {}
+    for i in range(20000):
+        key = random.randrange(4) if random.random() < 0.8 else random.randrange(N_ELEMENTS)
+        op = random.random()
+        if op < 0.05:
+            avl.insert(key, i)
+            ref_dict[key] = i
+        elif op < 0.1:
+            avl.erase(key)
+            ref_dict.pop(key, None)
+        elif key in ref_dict:
+            assert avl.get(key) == ref_dict[key]
+        else:
+            with pytest.raises(KeyError):
+                avl.get(key)
+
+    with pytest.raises(RuntimeError):
+        AVLTreeMap().hot_stats()
+
+def test_lsm_concurrent_compaction(tmp_path):
+    store = LSMStore(str(tmp_path), memtable_limit=2000, compaction_threshold=3)
+    for i in range(6000):
+        store.insert(i, i)
+    store.compact()
+    store.compact()
+    store.close()
+    assert len(store.runs) == 1
+    assert list(store.items()) == [(i, i) for i in range(6000)]
+
+def test_lsm_compaction_error(tmp_path):
+    store = LSMStore(str(tmp_path), memtable_limit=N_ELEMENTS, compaction_threshold=2)
+
+    def broken_merge(sources, drop_tombstones):
+        raise RuntimeError("merge failed")
+
+    store._merge = broken_merge
+    for i in range(2 * N_ELEMENTS):
+        store.insert(i, i)
+    with pytest.raises(RuntimeError):
+        store.close()
+    store.wait_for_compaction()
+
 if __name__ == "__main__":
     pytest.main()
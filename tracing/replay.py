@@ -0,0 +1,162 @@
+import argparse
+import ast
+import cProfile
+import importlib
+import io
+import os
+import pstats
+import sys
+import time
+
+from tracer import (
+    KIND_MAP, OP_NAMES, OP_INSERT, OP_ERASE, OP_GET, OP_CONTAINS, OP_SPLIT,
+    OP_JOIN, OP_ERASE_RANGE, OP_POP_RANGE, OP_LOAD, OP_ERASE_MIN, OP_ERASE_MAX,
+    OP_BULK_BEGIN, OP_BULK_END, read_trace
+)
+
+DEFAULT_ENGINES = {
+    0: "avl_tree:AVLTree",
+    1: "avl_map:AVLTreeMap",
+}
+
+
+def load_engine(spec):
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def parse_option(text):
+    # key=value; values go through ast.literal_eval, anything else stays a string
+    key, sep, value = text.partition("=")
+    if not sep or not key:
+        raise argparse.ArgumentTypeError(f"Expected key=value, got {text!r}")
+    try:
+        value = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        pass
+    return key, value
+
+
+def replay(path, engine=None, options=None):
+    # options are keyword arguments for the engine constructor
+    records = read_trace(path)
+    kind = next(records)
+    if engine is None:
+        engine = load_engine(DEFAULT_ENGINES[kind])
+    options = options or {}
+
+    trees = {}
+    # open bulk_loading() blocks of every tree, innermost last
+    bulk = {}
+    latencies = {}
+    clock = time.perf_counter_ns
+
+    for op, tree_id, args in records:
+        if op == OP_LOAD:
+            tree = trees[tree_id] = engine(**options)
+            for item in args:
+                if kind == KIND_MAP:
+                    tree.insert(*item)
+                else:
+                    tree.insert(item)
+            continue
+
+        tree = trees[tree_id]
+        start = clock()
+        if op == OP_INSERT:
+            tree.insert(*args)
+        elif op == OP_ERASE:
+            tree.erase(args[0])
+        elif op == OP_GET:
+            try:
+                tree.get(args[0])
+            except KeyError:
+                pass
+        elif op == OP_CONTAINS:
+            args[0] in tree
+        elif op == OP_SPLIT:
+            trees[args[1]], trees[args[2]] = tree.split(args[0])
+        elif op == OP_JOIN:
+            tree.join(trees[args[0]])
+        elif op == OP_ERASE_RANGE:
+            tree.erase_range(args[0], args[1])
+        elif op == OP_POP_RANGE:
+            trees[args[2]] = tree.pop_range(args[0], args[1])
+        elif op == OP_ERASE_MIN:
+            tree.erase_min()
+        elif op == OP_ERASE_MAX:
+            tree.erase_max()
+        elif op == OP_BULK_BEGIN:
+            block = tree.bulk_loading()
+            block.__enter__()
+            bulk.setdefault(tree_id, []).append(block)
+        elif op == OP_BULK_END:
+            bulk[tree_id].pop().__exit__(None, None, None)
+        elapsed = clock() - start
+
+        latencies.setdefault(op, []).append(elapsed)
+
+    return trees, latencies
+
+
+def format_histogram(samples, width=40):
+    # buckets are powers of two in nanoseconds
+    buckets = {}
+    for ns in samples:
+        bucket = max(ns, 1).bit_length() - 1
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+
+    ordered = sorted(samples)
+    n = len(ordered)
+    lines = [
+        f"  count={n} p50={ordered[n // 2]}ns p99={ordered[min(n - 1, n * 99 // 100)]}ns max={ordered[-1]}ns"
+    ]
+    peak = max(buckets.values())
+    for bucket in range(min(buckets), max(buckets) + 1):
+        count = buckets.get(bucket, 0)
+        bar = "#" * (count * width // peak)
+        lines.append(f"  {2 ** bucket:>10}ns {count:>9} {bar}")
+    return "\n".join(lines)
+
+
+def format_report(latencies):
+    sections = []
+    for op in sorted(latencies):
+        sections.append(f"{OP_NAMES[op]}:\n{format_histogram(latencies[op])}")
+    return "\n\n".join(sections)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay an AVLTree/AVLTreeMap trace")
+    parser.add_argument("trace")
+    parser.add_argument("--engine", help="module:Class to replay against, e.g. avl_map:AVLTreeMap")
+    parser.add_argument("--path", action="append", default=[],
+                        help="directory to search for the engine module (repeatable)")
+    parser.add_argument("--option", type=parse_option, action="append", default=[], metavar="KEY=VALUE",
+                        help="engine constructor argument, e.g. backend=btree or order=16 (repeatable)")
+    parser.add_argument("--profile", type=int, default=0, metavar="N",
+                        help="run under cProfile and print the N hottest functions")
+    args = parser.parse_args(argv)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path[:0] = args.path + [os.getcwd(), os.path.join(root, "avl"), os.path.join(root, "map")]
+    engine = load_engine(args.engine) if args.engine else None
+    options = dict(args.option)
+
+    if args.profile:
+        profiler = cProfile.Profile()
+        _, latencies = profiler.runcall(replay, args.trace, engine, options)
+    else:
+        _, latencies = replay(args.trace, engine, options)
+
+    print(format_report(latencies))
+
+    if args.profile:
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("tottime").print_stats(args.profile)
+        print()
+        print(out.getvalue())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import os
+import random
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "avl"), os.path.join(ROOT, "map")]
+
+from avl_tree import AVLTree
+from avl_map import AVLTreeMap
+from tracer import (
+    OP_INSERT, OP_ERASE, OP_GET, OP_SPLIT, OP_JOIN, OP_LOAD, OP_BULK_END, KIND_MAP, read_trace, record
+)
+from replay import replay, format_report, main
+
+N_ELEMENTS = 30
+
+def map_items(avl):
+    arr = []
+    AVLTreeMap.Node.in_order(avl.root, lambda node: arr.append((node.key, node.value)))
+    return arr
+
+def tree_values(avl):
+    arr = []
+    AVLTree.Node.in_order(avl.root, lambda node: arr.append(node.val))
+    return arr
+
+def test_roundtrip(tmp_path):
+    path = tmp_path / "map.trace"
+    avl = AVLTreeMap()
+    avl.insert(-1, "preloaded")
+
+    recorder, traced = record(avl, path)
+    with recorder:
+        for i in range(N_ELEMENTS):
+            traced.insert(i, hex(i))
+        traced.get(3)
+        assert 3 in traced
+        traced.erase(5)
+        traced.insert(2.5, ("tuple", 1))
+
+    records = read_trace(path)
+    assert next(records) == KIND_MAP
+    records = list(records)
+
+    assert records[0] == (OP_LOAD, 0, [(-1, "preloaded")])
+    assert records[1] == (OP_INSERT, 0, [0, "0x0"])
+    assert (OP_GET, 0, [3]) in records
+    assert records[-1] == (OP_INSERT, 0, [2.5, ("tuple", 1)])
+
+def test_replay_map(tmp_path):
+    path = tmp_path / "map.trace"
+    recorder, traced = record(AVLTreeMap(), path)
+    ref_dict = {}
+    with recorder:
+        for _ in range(1000):
+            key = random.randint(0, 10 * N_ELEMENTS)
+            if random.random() < 0.7:
+                traced.insert(key, hex(key))
+                ref_dict[key] = hex(key)
+            else:
+                traced.erase(key)
+                ref_dict.pop(key, None)
+            try:
+                traced.get(random.randint(0, 10 * N_ELEMENTS))
+            except KeyError:
+                pass
+
+    trees, latencies = replay(path)
+    assert map_items(trees[0]) == sorted(ref_dict.items())
+    assert len(latencies[OP_INSERT]) + len(latencies[OP_ERASE]) == 1000
+    assert len(latencies[OP_GET]) == 1000
+    assert "insert:" in format_report(latencies)
+
+def test_replay_split_join(tmp_path):
+    path = tmp_path / "set.trace"
+    other = AVLTree()
+    for i in range(N_ELEMENTS, 2 * N_ELEMENTS):
+        other.insert(i)
+
+    recorder, traced = record(AVLTree(), path)
+    with recorder:
+        for i in range(N_ELEMENTS):
+            traced.insert(i)
+        left, right = traced.split(N_ELEMENTS // 3)
+        right.erase(N_ELEMENTS // 2)
+        left.join(right)
+        left.join(other)
+        popped = left.pop_range(5, 10)
+        popped.insert(100)
+
+    trees, latencies = replay(path)
+    expected = [i for i in range(2 * N_ELEMENTS) if i != N_ELEMENTS // 2 and not 5 <= i < 10]
+    assert tree_values(trees[1]) == expected
+    assert tree_values(trees[4]) == [5, 6, 7, 8, 9, 100]
+    assert len(latencies[OP_SPLIT]) == 1
+    assert len(latencies[OP_JOIN]) == 2
+
+def test_cli(tmp_path, capsys):
+    path = tmp_path / "map.trace"
+    recorder, traced = record(AVLTreeMap(), path)
+    with recorder:
+        for i in range(N_ELEMENTS):
+            traced.insert(i, i)
+
+    main([str(path), "--engine", "avl_map:AVLTreeMap", "--profile", "5"])
+    out = capsys.readouterr().out
+    assert "insert:" in out
+    assert "count=30" in out
+    assert "function calls" in out
+
+def test_record_btree(tmp_path):
+    path = tmp_path / "btree.trace"
+    btree = AVLTreeMap(backend="btree", order=4)
+    btree.insert(-1, "preloaded")
+    recorder, traced = record(btree, path)
+    with recorder:
+        for i in range(N_ELEMENTS):
+            traced.insert(i, hex(i))
+        traced.erase(3)
+
+    records = list(read_trace(path))
+    assert records[0] == KIND_MAP
+    assert records[1] == (OP_LOAD, 0, [(-1, "preloaded")])
+
+    trees, _ = replay(path, options={"backend": "btree", "order": 4})
+    assert list(trees[0].items()) == list(btree.items())
+
+def test_replay_options(tmp_path, capsys):
+    path = tmp_path / "map.trace"
+    recorder, traced = record(AVLTreeMap(), path)
+    with recorder:
+        for i in range(N_ELEMENTS):
+            traced.insert(i, hex(i))
+
+    trees, _ = replay(path, options={"backend": "btree", "order": 4})
+    assert type(trees[0]).__name__ == "BTreeMap"
+    assert trees[0].order == 4
+    assert list(trees[0].items()) == [(i, hex(i)) for i in range(N_ELEMENTS)]
+
+    main([str(path), "--option", "backend=btree", "--option", "order=16"])
+    assert "count=30" in capsys.readouterr().out
+
+def test_join_other_recorder(tmp_path):
+    recorder, traced = record(AVLTreeMap(), tmp_path / "a.trace")
+    other_recorder, other = record(AVLTreeMap(), tmp_path / "b.trace")
+    with recorder, other_recorder:
+        traced.insert(1, 1)
+        other.insert(50, 1)
+        traced.join(other)
+
+    assert len(other) == 0
+    assert list(other.items()) == []
+    assert list(traced.items()) == [(1, 1), (50, 1)]
+    trees, _ = replay(tmp_path / "a.trace")
+    assert map_items(trees[0]) == [(1, 1), (50, 1)]
+
+def test_erase_minmax_and_bulk(tmp_path):
+    path = tmp_path / "set.trace"
+    recorder, traced = record(AVLTree(), path)
+    with recorder:
+        for i in range(10):
+            traced.insert(i)
+        assert traced.erase_min() == 0
+        assert traced.erase_max() == 9
+        with traced.bulk_loading() as bulk:
+            bulk.insert(100)
+            bulk.erase(5)
+
+    trees, latencies = replay(path)
+    assert tree_values(trees[0]) == tree_values(traced.tree) == [1, 2, 3, 4, 6, 7, 8, 100]
+    assert trees[0].pending is None
+    assert len(latencies[OP_BULK_END]) == 1
+
+def test_surrogate_key(tmp_path):
+    path = tmp_path / "map.trace"
+    recorder, traced = record(AVLTreeMap(), path)
+    with recorder:
+        traced.insert("\ud800", 1)
+
+    trees, _ = replay(path)
+    assert map_items(trees[0]) == [("\ud800", 1)]
+
+def test_bad_file(tmp_path):
+    path = tmp_path / "garbage"
+    path.write_bytes(b"not a trace")
+    with pytest.raises(ValueError):
+        next(read_trace(path))
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,271 @@
+import pickle
+import struct
+from contextlib import contextmanager
+
+MAGIC = b"AVLTRACE"
+VERSION = 1
+
+KIND_SET = 0
+KIND_MAP = 1
+
+OP_INSERT = 0
+OP_ERASE = 1
+OP_GET = 2
+OP_CONTAINS = 3
+OP_SPLIT = 4
+OP_JOIN = 5
+OP_ERASE_RANGE = 6
+OP_POP_RANGE = 7
+OP_LOAD = 8
+OP_ERASE_MIN = 9
+OP_ERASE_MAX = 10
+OP_BULK_BEGIN = 11
+OP_BULK_END = 12
+
+OP_NAMES = {
+    OP_INSERT: "insert",
+    OP_ERASE: "erase",
+    OP_GET: "get",
+    OP_CONTAINS: "contains",
+    OP_SPLIT: "split",
+    OP_JOIN: "join",
+    OP_ERASE_RANGE: "erase_range",
+    OP_POP_RANGE: "pop_range",
+    OP_LOAD: "load",
+    OP_ERASE_MIN: "erase_min",
+    OP_ERASE_MAX: "erase_max",
+    OP_BULK_BEGIN: "bulk_begin",
+    OP_BULK_END: "bulk_end",
+}
+
+_HEADER = struct.Struct("<BB")
+_RECORD = struct.Struct("<BI")
+_COUNT = struct.Struct("<I")
+_INT = struct.Struct("<q")
+_FLOAT = struct.Struct("<d")
+
+_TAG_NONE = b"n"
+_TAG_INT = b"i"
+_TAG_FLOAT = b"f"
+_TAG_STR = b"s"
+_TAG_PICKLE = b"p"
+
+
+def _write_obj(f, obj):
+    if obj is None:
+        f.write(_TAG_NONE)
+    elif type(obj) is int and -2**63 <= obj < 2**63:
+        f.write(_TAG_INT + _INT.pack(obj))
+    elif type(obj) is float:
+        f.write(_TAG_FLOAT + _FLOAT.pack(obj))
+    elif type(obj) is str:
+        # lone surrogates are valid str keys
+        data = obj.encode("utf-8", "surrogatepass")
+        f.write(_TAG_STR + _COUNT.pack(len(data)) + data)
+    else:
+        data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        f.write(_TAG_PICKLE + _COUNT.pack(len(data)) + data)
+
+
+def _read_exact(f, n):
+    data = f.read(n)
+    if len(data) != n:
+        raise EOFError("Truncated trace")
+    return data
+
+
+def _read_obj(f):
+    tag = _read_exact(f, 1)
+    if tag == _TAG_NONE:
+        return None
+    if tag == _TAG_INT:
+        return _INT.unpack(_read_exact(f, _INT.size))[0]
+    if tag == _TAG_FLOAT:
+        return _FLOAT.unpack(_read_exact(f, _FLOAT.size))[0]
+
+    n, = _COUNT.unpack(_read_exact(f, _COUNT.size))
+    data = _read_exact(f, n)
+    if tag == _TAG_STR:
+        return data.decode("utf-8", "surrogatepass")
+    if tag == _TAG_PICKLE:
+        return pickle.loads(data)
+    raise ValueError(f"Unknown tag {tag!r} in trace")
+
+
+class TraceRecorder:
+    def __init__(self, path, kind):
+        self.file = open(path, "wb")
+        self.kind = kind
+        self.next_id = 0
+        self.file.write(MAGIC + _HEADER.pack(VERSION, kind))
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _new_id(self):
+        tree_id = self.next_id
+        self.next_id += 1
+        return tree_id
+
+    def write(self, op, tree_id, *args):
+        self.file.write(_RECORD.pack(op, tree_id))
+        for arg in args:
+            _write_obj(self.file, arg)
+
+    def wrap(self, tree):
+        # the tree may already hold elements; they are written as a LOAD record
+        traced = TracedTree(self, tree, self._new_id())
+        items = list(tree.items())
+
+        self.file.write(_RECORD.pack(OP_LOAD, traced.tree_id) + _COUNT.pack(len(items)))
+        for item in items:
+            if self.kind == KIND_MAP:
+                _write_obj(self.file, item[0])
+                _write_obj(self.file, item[1])
+            else:
+                _write_obj(self.file, item)
+        return traced
+
+    def _wrap_result(self, tree):
+        return TracedTree(self, tree, self._new_id())
+
+
+# forwards every call to the wrapped tree, logging the ones replay cares about.
+# Every write must have its own method here: a write passed through
+# __getattr__ would change the tree without appearing in the trace
+class TracedTree:
+    def __init__(self, recorder, tree, tree_id):
+        self.recorder = recorder
+        self.tree = tree
+        self.tree_id = tree_id
+
+    def __getattr__(self, name):
+        return getattr(self.tree, name)
+
+    def __len__(self):
+        return len(self.tree)
+
+    def __str__(self):
+        return str(self.tree)
+
+    def insert(self, *args):
+        self.recorder.write(OP_INSERT, self.tree_id, *args)
+        return self.tree.insert(*args)
+
+    def erase(self, key):
+        self.recorder.write(OP_ERASE, self.tree_id, key)
+        return self.tree.erase(key)
+
+    def get(self, key):
+        self.recorder.write(OP_GET, self.tree_id, key)
+        return self.tree.get(key)
+
+    def __contains__(self, key):
+        self.recorder.write(OP_CONTAINS, self.tree_id, key)
+        return key in self.tree
+
+    def split(self, x):
+        left, right = self.tree.split(x)
+        left = self.recorder._wrap_result(left)
+        right = self.recorder._wrap_result(right)
+        self.recorder.write(OP_SPLIT, self.tree_id, x, left.tree_id, right.tree_id)
+        return left, right
+
+    def erase_min(self):
+        self.recorder.write(OP_ERASE_MIN, self.tree_id)
+        return self.tree.erase_min()
+
+    def erase_max(self):
+        self.recorder.write(OP_ERASE_MAX, self.tree_id)
+        return self.tree.erase_max()
+
+    @contextmanager
+    def bulk_loading(self):
+        # yields the traced tree, so writes inside the block are recorded too
+        self.recorder.write(OP_BULK_BEGIN, self.tree_id)
+        try:
+            with self.tree.bulk_loading():
+                yield self
+        finally:
+            self.recorder.write(OP_BULK_END, self.tree_id)
+
+    def join(self, other):
+        # a tree traced by another recorder is unknown to this trace, so its
+        # contents are loaded under a new id; join always gets the raw tree
+        raw = other.tree if isinstance(other, TracedTree) else other
+        if isinstance(other, TracedTree) and other.recorder is self.recorder:
+            other_id = other.tree_id
+        else:
+            other_id = self.recorder.wrap(raw).tree_id
+        self.recorder.write(OP_JOIN, self.tree_id, other_id)
+        return self.tree.join(raw)
+
+    def erase_range(self, lo, hi):
+        self.recorder.write(OP_ERASE_RANGE, self.tree_id, lo, hi)
+        return self.tree.erase_range(lo, hi)
+
+    def pop_range(self, lo, hi):
+        popped = self.recorder._wrap_result(self.tree.pop_range(lo, hi))
+        self.recorder.write(OP_POP_RANGE, self.tree_id, lo, hi, popped.tree_id)
+        return popped
+
+
+def record(tree, path):
+    kind = KIND_MAP if hasattr(tree, "get") else KIND_SET
+    recorder = TraceRecorder(path, kind)
+    return recorder, recorder.wrap(tree)
+
+
+_ARG_COUNTS = {
+    OP_ERASE: 1,
+    OP_GET: 1,
+    OP_CONTAINS: 1,
+    OP_SPLIT: 3,
+    OP_JOIN: 1,
+    OP_ERASE_RANGE: 2,
+    OP_POP_RANGE: 3,
+    OP_ERASE_MIN: 0,
+    OP_ERASE_MAX: 0,
+    OP_BULK_BEGIN: 0,
+    OP_BULK_END: 0,
+}
+
+
+# yields the trace kind first, then (op, tree_id, args) for every record
+def read_trace(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a trace file")
+        version, kind = _HEADER.unpack(_read_exact(f, _HEADER.size))
+        if version != VERSION:
+            raise ValueError(f"Unsupported trace version {version}")
+        yield kind
+
+        while True:
+            head = f.read(_RECORD.size)
+            if not head:
+                return
+            if len(head) != _RECORD.size:
+                raise EOFError("Truncated trace")
+            op, tree_id = _RECORD.unpack(head)
+
+            if op == OP_LOAD:
+                n, = _COUNT.unpack(_read_exact(f, _COUNT.size))
+                per_item = 2 if kind == KIND_MAP else 1
+                args = [_read_obj(f) for _ in range(n * per_item)]
+                if kind == KIND_MAP:
+                    args = list(zip(args[::2], args[1::2]))
+            elif op == OP_INSERT:
+                args = [_read_obj(f) for _ in range(2 if kind == KIND_MAP else 1)]
+            elif op in _ARG_COUNTS:
+                args = [_read_obj(f) for _ in range(_ARG_COUNTS[op])]
+            else:
+                raise ValueError(f"Unknown op {op} in trace")
+
+            yield op, tree_id, args